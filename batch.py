@@ -0,0 +1,198 @@
+from portfolio import default_configs, solve_config
+from testcase import testboards
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+
+"""
+Batch solving of a puzzle corpus. Boards are read one JSON record per
+line from a file or stdin,
+    {"id": "b1", "board": [[1, 1, 2, ...], ...], "numtree": 2}
+("id" is optional, the line number by default), solved in a pool of
+worker processes with one configuration (see portfolio.py) and written
+to stdout one JSON result per line:
+    {"id": "b1", "status": "sat", "solution": [[0, 1, ...], ...],
+     "nDecisions": 52, "nPrunings": 911, "runtime": 0.012}
+status is "sat", "unsat", "unknown" or "error" (then "error" says why).
+Results come in the order the boards are solved, or with --ordered in
+input order.
+
+Each board can be given limits (see cspbase.Budget): --time-limit
+seconds, --max-decisions, --max-prunings and --max-memory megabytes. A
+board that reaches one is given up as "unknown", with "stopped" the
+limit and the statistics so far, and the worker goes on to the next
+board.
+
+No more than --window boards (by default 2 per worker) are read ahead of
+the results written, so memory stays the same however long the corpus:
+the next board is read only when a result has been written.
+
+    python batch.py boards.jsonl --workers 4 --ordered > results.jsonl
+    python batch.py boards.jsonl --time-limit 30 > results.jsonl
+    python batch.py --export > testboards.jsonl
+"""
+
+
+def parse_record(line, lineno):
+    """(id, board, numtree) of one input line, ValueError if malformed"""
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("record is not a JSON object")
+    board = record.get("board")
+    numtree = record.get("numtree")
+    if (not isinstance(board, list) or not board
+            or any(not isinstance(row, list) or len(row) != len(board)
+                   for row in board)):
+        raise ValueError("board is not a square list of lists")
+    if not isinstance(numtree, int) or numtree < 1:
+        raise ValueError("numtree is not a positive integer")
+    return record.get("id", lineno), board, numtree
+
+
+def solve_record(job):
+    """Worker: solve one (id, board, numtree, config, limits), return its
+    result"""
+    rid, board, numtree, config, limits = job
+    try:
+        result = solve_config((board, numtree, config, limits))
+    except Exception as e:
+        return {"id": rid, "status": "error", "error": repr(e)}
+    status = {True: "sat", False: "unsat", None: "unknown"}[result["status"]]
+    record = {"id": rid, "status": status}
+    if result["stopped"] is not None:
+        record["stopped"] = result["stopped"]
+    record.update({"solution": result["solution"],
+                   "nDecisions": result["nDecisions"],
+                   "nPrunings": result["nPrunings"],
+                   "runtime": result["runtime"]})
+    return record
+
+
+def batch_solve(lines, config=default_configs[0], workers=None, window=None,
+                ordered=False, limits=None):
+    """
+    Solve the boards of the input lines, yielding the results as they are
+    finished (in input order if ordered). At most window boards are in
+    the pool or waiting to be yielded at any time. Blank lines are
+    skipped, a malformed one gives an "error" result, and so does a board
+    whose worker crashed. limits is a dict of Budget arguments for each
+    board, e.g. {"time": 30}.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if window is None:
+        window = 2 * workers
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = dict()        #future -> input position
+        done = dict()           #input position -> result, for ordered
+        emitted = 0             #input positions yielded so far, in order
+        count = 0               #input positions read so far
+        records = enumerate(lines, 1)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) + len(done) < window:
+                try:
+                    lineno, line = next(records)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    rid, board, numtree = parse_record(line, lineno)
+                    future = pool.submit(solve_record,
+                                         (rid, board, numtree, config,
+                                          limits))
+                except ValueError as e:
+                    result = {"id": lineno, "status": "error",
+                              "error": str(e)}
+                except concurrent.futures.BrokenExecutor as e:
+                    #a worker died and took the pool with it
+                    result = {"id": rid, "status": "error",
+                              "error": repr(e)}
+                else:
+                    pending[future] = (count, rid)
+                    result = None
+                if result is not None:
+                    if ordered:
+                        done[count] = result
+                    else:
+                        yield result
+                count += 1
+            if ordered:
+                while emitted in done:
+                    yield done.pop(emitted)
+                    emitted += 1
+            if not pending:
+                if exhausted and not done:
+                    return
+                continue
+            finished, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                position, rid = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    #the worker crashed, e.g. BrokenProcessPool
+                    result = {"id": rid, "status": "error",
+                              "error": repr(e)}
+                if ordered:
+                    done[position] = result
+                else:
+                    yield result
+
+
+def export_testboards(out=sys.stdout):
+    """Write the boards of testcase.py as batch input records"""
+    for name, (board, numtree) in testboards.items():
+        out.write(json.dumps({"id": name, "board": board,
+                              "numtree": numtree}) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Solve a JSONL corpus of alberi boards")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="JSONL file of boards, - for stdin")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--window", type=int, default=None,
+                        help="boards read ahead of the results written")
+    parser.add_argument("--ordered", action="store_true",
+                        help="write the results in input order")
+    parser.add_argument("--config", nargs=5, default=default_configs[0],
+                        metavar=("MODEL", "PRIORITY", "PROP", "HEUR",
+                                 "SEARCH"))
+    parser.add_argument("--time-limit", type=float, default=None,
+                        help="seconds per board")
+    parser.add_argument("--max-decisions", type=int, default=None)
+    parser.add_argument("--max-prunings", type=int, default=None)
+    parser.add_argument("--max-memory", type=float, default=None,
+                        help="megabytes per worker")
+    parser.add_argument("--export", action="store_true",
+                        help="write testcase.py's boards as input and exit")
+    args = parser.parse_args(argv)
+    if args.export:
+        export_testboards()
+        return
+    config = tuple(args.config)
+    config = config[:1] + (int(config[1]),) + config[2:]
+    limits = {"time": args.time_limit, "decisions": args.max_decisions,
+              "prunings": args.max_prunings,
+              "memory": None if args.max_memory is None
+                        else int(args.max_memory * 2 ** 20)}
+    # no Budget at all, rather than one ticking without limits, when no
+    # limit is given
+    limits = {k: v for k, v in limits.items() if v is not None} or None
+    source = sys.stdin if args.input == "-" else open(args.input)
+    with source:
+        for result in batch_solve(source, config, args.workers, args.window,
+                                  args.ordered, limits):
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
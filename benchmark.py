@@ -0,0 +1,540 @@
+from cspbase import *
+from model import *
+from propagators import *
+from testcase import testboards
+from bitboard import BitboardSolver
+from dlx import DLX
+from portfolio import default_configs
+from parallel import parallel_solve
+import contextlib
+import csv
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+"""
+Benchmarks for the solver internals. Each bench_* function runs on the
+named boards of testcase.py and prints one line per measurement, e.g.
+
+    python benchmark.py domains
+
+bench_suite is the general harness: every board x configuration (the
+tuples of portfolio.py), model building and search timed apart with
+perf_counter_ns over a warm-up and N repetitions, median/IQR reported
+and written to JSON and CSV.
+"""
+
+# boards the GAC style propagators finish in seconds (all but the 2-tree
+# solveable_2tree3 and the two 20x20 boards)
+quick_boards = ["solveable_1tree1", "solveable_1tree2", "solveable_1tree3",
+                "solveable_1tree4", "solveable_1tree5", "unsolveable_1tree1",
+                "unsolveable_1tree2", "unsolveable_1tree3",
+                "unsolveable_1tree4", "unsolveable_1tree5",
+                "solveable_2tree1", "solveable_2tree2", "unsolveable_2tree1",
+                "unsolveable_2tree2", "unsolveable_2tree3"]
+
+
+@contextlib.contextmanager
+def quiet():
+    """Send everything printed inside the with block to /dev/null"""
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+
+def solve_quietly(csp, propagator, heuristic, **search_args):
+    """Run bt_search with its printing sent to /dev/null, return the BT"""
+    bt = BT(csp, heuristic)
+    with quiet():
+        bt.bt_search(propagator, **search_args)
+    return bt
+
+
+class OutOfCalls(Exception):
+    """Raised by a capped propagator once its call budget is spent"""
+
+
+class Counted:
+    """Propagator wrapper counting its calls. With a limit it raises
+    OutOfCalls on the call after the limit, which ends the search"""
+
+    def __init__(self, propagator, limit=None):
+        self.propagator = propagator
+        self.limit = limit
+        self.calls = 0
+        self.__name__ = propagator.__name__
+
+    def __call__(self, csp, newVar=None):
+        self.calls += 1
+        if self.limit is not None and self.calls > self.limit:
+            raise OutOfCalls()
+        return self.propagator(csp, newVar)
+
+
+def capped(propagator, calls):
+    """Wrap propagator so the search stops after that many calls. Both
+    engines make the same calls in the same order, so this times an
+    identical slice of a search that is too long to run to the end."""
+    return Counted(propagator, calls)
+
+
+def bench_domains(names=quick_boards, propagators=[prop_GAC, prop_alberi],
+                  heuristic="MRV", model=alberi_model_1):
+    """
+    Compare the bitmask Variable with the old list based ListVariable.
+    Both solve the same model so the decision and pruning counts must
+    agree; only the time spent in bt_search differs.
+    """
+    print("{:20} {:12} {:>9} {:>9} {:>9} {:>8}".format(
+        "board", "propagator", "nodes", "list(s)", "bits(s)", "speedup"))
+    total = {ListVariable: 0, Variable: 0}
+    for name in names:
+        board, numtree = testboards[name]
+        for prop in propagators:
+            times = dict()
+            for var_type in (ListVariable, Variable):
+                csp, _ = model(board, 0, numtree, var_type)
+                start = time.perf_counter()
+                bt = solve_quietly(csp, prop, heuristic)
+                times[var_type] = time.perf_counter() - start
+                total[var_type] += times[var_type]
+            print("{:20} {:12} {:>9} {:>9.4f} {:>9.4f} {:>7.2f}x".format(
+                name, prop.__name__, bt.nDecisions, times[ListVariable],
+                times[Variable], times[ListVariable] / times[Variable]))
+    print("total: list {:.3f}s, bits {:.3f}s, speedup {:.2f}x".format(
+        total[ListVariable], total[Variable],
+        total[ListVariable] / total[Variable]))
+
+
+def bench_engines(names=["solveable_3trees", "unsolveable_3trees",
+                         "solveable_2tree3", "unsolveable_2tree3"],
+                  propagator=prop_alberi, heuristic="MAV", calls=20000,
+                  model=alberi_model_1):
+    """
+    Recursive bt_recurse against the explicit-stack bt_iterate. Each
+    search is cut off after `calls` propagator calls (the 20x20 boards
+    do not finish in reasonable time), so both engines do exactly the
+    same work and the rates compare the per-node overhead.
+    """
+    print("{:20} {:10} {:>9} {:>9} {:>9} {:>9}".format(
+        "board", "engine", "nodes", "prunings", "time(s)", "nodes/s"))
+    for name in names:
+        board, numtree = testboards[name]
+        for iterative in (False, True):
+            csp, _ = model(board, 0, numtree)
+            start = time.perf_counter()
+            try:
+                bt = BT(csp, heuristic)
+                with quiet():
+                    bt.bt_search(capped(propagator, calls), iterative)
+            except OutOfCalls:
+                pass
+            elapsed = time.perf_counter() - start
+            print("{:20} {:10} {:>9} {:>9} {:>9.3f} {:>9.0f}".format(
+                name, "iterative" if iterative else "recursive",
+                bt.nDecisions, bt.nPrunings, elapsed,
+                bt.nDecisions / elapsed))
+
+
+def bench_queues(names=quick_boards, propagators=[prop_GAC, prop_alberi],
+                 heuristic="MAV", models=[alberi_model_1, alberi_model_2]):
+    """
+    LIFO against FIFO revision order in prop_GAC/prop_alberi: number of
+    constraint revisions (csp.queue.revisions), decisions and time.
+    """
+    print("{:20} {:15} {:12} {:6} {:>8} {:>10} {:>9}".format(
+        "board", "model", "propagator", "queue", "nodes", "revisions",
+        "time(s)"))
+    total = dict()
+    for name in names:
+        board, numtree = testboards[name]
+        for model in models:
+            for prop in propagators:
+                for policy in ("LIFO", "FIFO"):
+                    csp, _ = model(board, 0, numtree)
+                    csp.set_queue_policy(policy)
+                    start = time.perf_counter()
+                    bt = solve_quietly(csp, prop, heuristic)
+                    elapsed = time.perf_counter() - start
+                    key = (model.__name__, prop.__name__, policy)
+                    revs, secs = total.get(key, (0, 0))
+                    total[key] = (revs + csp.queue.revisions, secs + elapsed)
+                    print("{:20} {:15} {:12} {:6} {:>8} {:>10} {:>9.4f}".format(
+                        name, model.__name__, prop.__name__, policy,
+                        bt.nDecisions, csp.queue.revisions, elapsed))
+    print("totals:")
+    for (model, prop, policy), (revs, secs) in total.items():
+        print("{:15} {:12} {:6} {:>10} revisions {:>8.3f}s".format(
+            model, prop, policy, revs, secs))
+
+
+def bench_bitboard(names=quick_boards + ["solveable_2tree3", "solveable_3trees"],
+                   propagator=prop_count, heuristic="MAV-O",
+                   model=alberi_model_1):
+    """
+    The object model (model + BT) against BitboardSolver, timing from
+    the board to the answer so model creation counts for both. The
+    engines branch differently, so their decision counts differ.
+    """
+    print("{:20} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+        "board", "BT nodes", "BT(s)", "bb nodes", "bb(s)", "speedup"))
+    for name in names:
+        board, numtree = testboards[name]
+        start = time.perf_counter()
+        csp, _ = model(board, 0, numtree)
+        bt = solve_quietly(csp, propagator, heuristic)
+        bt_time = time.perf_counter() - start
+        start = time.perf_counter()
+        solver = BitboardSolver(board, numtree)
+        solver.solve()
+        bb_time = time.perf_counter() - start
+        print("{:20} {:>9} {:>9.4f} {:>9} {:>9.4f} {:>7.1f}x".format(
+            name, bt.nDecisions, bt_time, solver.nDecisions, bb_time,
+            bt_time / bb_time))
+
+
+def bench_dlx(names=[name for name in quick_boards if "1tree" in name],
+              propagators=[prop_GAC, prop_count], heuristic="MAV-O",
+              model=alberi_model_1):
+    """
+    The DLX exact cover engine against the CSP path on the one tree
+    boards, from the board to the answer (model or matrix building
+    included).
+    """
+    print("{:20} {:12} {:>9} {:>9} {:>9}".format(
+        "board", "engine", "nodes", "prunings", "time(s)"))
+    for name in names:
+        board, numtree = testboards[name]
+        for prop in propagators:
+            start = time.perf_counter()
+            csp, _ = model(board, 0, numtree)
+            bt = solve_quietly(csp, prop, heuristic)
+            print("{:20} {:12} {:>9} {:>9} {:>9.4f}".format(
+                name, prop.__name__, bt.nDecisions, bt.nPrunings,
+                time.perf_counter() - start))
+        start = time.perf_counter()
+        dlx = DLX(board, numtree)
+        with quiet():
+            dlx.dlx_search()
+        print("{:20} {:12} {:>9} {:>9} {:>9.4f}".format(
+            name, "DLX", dlx.nDecisions, dlx.nPrunings,
+            time.perf_counter() - start))
+
+
+def bench_learning(names=["unsolveable_1tree3", "unsolveable_1tree5",
+                          "unsolveable_2tree1", "unsolveable_2tree2",
+                          "unsolveable_2tree3", "solveable_3trees"],
+                   propagators=[prop_FC, prop_GAC, prop_count],
+                   heuristic="MAV-O", model=alberi_model_1):
+    """
+    bt_search with nogood learning off and on, on boards without a
+    solution (solveable_3trees has none either, see testcase.py).
+    unsolveable_3trees is left out, it has a solution.
+    """
+    print("{:20} {:12} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+        "board", "propagator", "nodes", "time(s)", "nodes(L)", "time(L)",
+        "learned"))
+    for name in names:
+        board, numtree = testboards[name]
+        for prop in propagators:
+            result = []
+            for learning in (False, True):
+                csp, _ = model(board, 0, numtree)
+                start = time.perf_counter()
+                bt = solve_quietly(csp, prop, heuristic, learning=learning)
+                result += [bt.nDecisions, time.perf_counter() - start]
+            print("{:20} {:12} {:>9} {:>9.4f} {:>9} {:>9.4f} {:>8}".format(
+                name, prop.__name__, *result, bt.nogoods.nLearned))
+
+
+def bench_backjumping(names=["solveable_2tree1", "solveable_2tree2",
+                             "unsolveable_2tree2", "unsolveable_2tree3"],
+                      propagators=[prop_FC, prop_GAC, prop_alberi],
+                      heuristic="MAV-O", modes=["BT", "CBJ", "CBJ+learning"],
+                      model=alberi_model_1):
+    """
+    Chronological backtracking against conflict directed backjumping
+    (and backjumping with learning): nodes and time of each search
+    mode of search_modes.
+    """
+    print("{:20} {:12} {:13} {:>9} {:>9}".format(
+        "board", "propagator", "search", "nodes", "time(s)"))
+    for name in names:
+        board, numtree = testboards[name]
+        for prop in propagators:
+            for mode in modes:
+                csp, _ = model(board, 0, numtree)
+                start = time.perf_counter()
+                bt = solve_quietly(csp, prop, heuristic, **search_modes[mode])
+                print("{:20} {:12} {:13} {:>9} {:>9.4f}".format(
+                    name, prop.__name__, mode, bt.nDecisions,
+                    time.perf_counter() - start))
+
+
+def bench_parallel(names=["solveable_3trees", "unsolveable_3trees"],
+                   workers=[1, 2, 4, 8, 16], timeout=60):
+    """
+    Scaling of parallel_solve with the number of workers: the unsat
+    solveable_3trees and unsolveable_3trees, which has a solution (see
+    testcase.py), which the default configuration does not find in a
+    minute. A run that takes longer than timeout seconds is stopped,
+    then the decisions made so far per second are the figure to
+    compare. With fewer CPUs than workers the extra workers only
+    share the same CPUs.
+    """
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:20} {:>7} {:>7} {:>10} {:>9} {:>11} {:>8}".format(
+        "board", "workers", "status", "nodes", "time(s)", "subproblems",
+        "nodes/s"))
+    for name in names:
+        board, numtree = testboards[name]
+        for n in workers:
+            r = parallel_solve(board, numtree, workers=n, timeout=timeout)
+            print("{:20} {:>7} {:>7} {:>10} {:>9.3f} {:>11} {:>8.0f}".format(
+                name, n, str(r["status"]), r["nDecisions"], r["wallclock"],
+                r["subproblems"], r["nDecisions"] / r["wallclock"]))
+
+
+def bench_models(count=1000, models=[alberi_model_1, alberi_model_2],
+                 priority=0):
+    """
+    Model creation for a batch of count boards (testcase.py's boards over
+    and over), building every model from scratch against reparking the
+    cached skeleton of the board's size (cached_model).
+    """
+    names = list(testboards)
+    batch = [testboards[names[i % len(names)]] for i in range(count)]
+    print("{:16} {:>10} {:>10} {:>8}".format(
+        "model", "built(s)", "cached(s)", "speedup"))
+    for model in models:
+        skeletons.clear()
+        start = time.perf_counter()
+        for board, numtree in batch:
+            model(board, priority, numtree)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        for board, numtree in batch:
+            cached_model(model, board, priority, numtree)
+        cached = time.perf_counter() - start
+        print("{:16} {:>10.4f} {:>10.4f} {:>7.1f}x".format(
+            model.__name__, built, cached, built / cached))
+
+
+def bench_adjacency(names=["solveable_2tree2", "solveable_2tree3",
+                           "unsolveable_2tree3", "solveable_3trees"],
+                    models=[alberi_model_1, alberi_model_2, alberi_model_3],
+                    propagators=[prop_count, prop_GAC], heuristic="MAV-O"):
+    """
+    The three ways of modelling the adjacency rule: 2x2 windows, binary
+    pairs and the global no touch constraint. Per board and model the
+    number of constraints, the build time, the memory the model takes
+    (tracemalloc) and per propagator the search.
+    """
+    print("{:20} {:16} {:>5} {:>9} {:>8} {:12} {:>7} {:>8}".format(
+        "board", "model", "cons", "build(ms)", "mem(KB)", "propagator",
+        "nodes", "search(s)"))
+    for name in names:
+        board, numtree = testboards[name]
+        for model in models:
+            tracemalloc.start()
+            start = time.perf_counter()
+            csp, _ = model(board, 0, numtree)
+            build = time.perf_counter() - start
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            for propagator in propagators:
+                bt = solve_quietly(csp, propagator, heuristic)
+                print("{:20} {:16} {:>5} {:>9.2f} {:>8.0f} {:12} {:>7} {:>8.3f}".format(
+                    name, model.__name__, len(csp.cons), build * 1000,
+                    memory / 1024, propagator.__name__, bt.nDecisions,
+                    bt.runtime))
+
+
+def bench_regions(names=["solveable_2tree1", "solveable_2tree2",
+                         "solveable_2tree3", "unsolveable_2tree2",
+                         "unsolveable_2tree3", "solveable_3trees"],
+                  propagators=[prop_alberi, prop_alberi_region, prop_count,
+                               prop_count_region],
+                  heuristic="MAV-O", model=alberi_model_1):
+    """
+    The propagators with and without the pigeonhole reasoning on parks
+    and rows/columns layered over them (with_regions)
+    """
+    print("{:20} {:20} {:>8} {:>9}".format("board", "propagator", "nodes",
+                                           "search(s)"))
+    for name in names:
+        board, numtree = testboards[name]
+        for propagator in propagators:
+            csp, _ = model(board, 0, numtree)
+            bt = solve_quietly(csp, propagator, heuristic)
+            print("{:20} {:20} {:>8} {:>9.3f}".format(
+                name, propagator.__name__, bt.nDecisions, bt.runtime))
+
+
+def bench_values(names=quick_boards + ["solveable_2tree3"],
+                 orders=list(value_orders), propagator=prop_count,
+                 heuristic="MRV", model=alberi_model_1):
+    """
+    The value orders of BT on one model per board, switched between
+    searches without building the model again
+    """
+    print("{:20} {:10} {:>8} {:>9}".format("board", "values", "nodes",
+                                           "search(s)"))
+    for name in names:
+        board, numtree = testboards[name]
+        csp, _ = model(board, 0, numtree)
+        for order in orders:
+            bt = BT(csp, heuristic, order)
+            with quiet():
+                bt.bt_search(propagator)
+            print("{:20} {:10} {:>8} {:>9.3f}".format(
+                name, order, bt.nDecisions, bt.runtime))
+
+
+def bench_wdeg(names=quick_boards + ["solveable_2tree3"],
+               heuristics=["MRV", "MAV-O", "dom/wdeg"],
+               propagator=prop_count, modes=["BT", "CBJ+learning"],
+               model=alberi_model_1):
+    """
+    dom/wdeg against the static heuristics, then dom/wdeg again on the
+    constraint weights the last search left ("again")
+    """
+    print("{:20} {:10} {:14} {:>8} {:>9}".format("board", "heuristic", "mode",
+                                                 "nodes", "search(s)"))
+    for name in names:
+        board, numtree = testboards[name]
+        for mode in modes:
+            for heuristic in heuristics + ["again"]:
+                if heuristic != "again":
+                    csp, _ = model(board, 0, numtree)
+                bt = solve_quietly(csp, propagator,
+                                   "dom/wdeg" if heuristic == "again"
+                                   else heuristic, **search_modes[mode])
+                print("{:20} {:10} {:14} {:>8} {:>9.3f}".format(
+                    name, heuristic, mode, bt.nDecisions, bt.runtime))
+
+
+def median_iqr(samples):
+    """median and interquartile range of samples"""
+    if len(samples) < 2:
+        return samples[0], 0
+    q1, q2, q3 = statistics.quantiles(samples, n=4)
+    return q2, q3 - q1
+
+
+def run_config(board, numtree, config, limit=None):
+    """
+    Build the model of config and search it once, printing nothing.
+    Return (model_ns, search_ns, status, bt, propagator calls); status
+    is True/False as bt_search returns it, None if the search was cut
+    off after limit propagator calls.
+    """
+    model, priority, prop, heuristic, search = config
+    start = time.perf_counter_ns()
+    csp, _ = models_by_name[model](board, priority, numtree)
+    model_ns = time.perf_counter_ns() - start
+    counted = Counted(props_by_name[prop], limit)
+    bt = BT(csp, heuristic)
+    start = time.perf_counter_ns()
+    with quiet():
+        try:
+            status = bt.bt_search(counted, **search_modes[search])
+            search_ns = bt.search_ns
+        except OutOfCalls:
+            status = None
+            search_ns = time.perf_counter_ns() - start
+    return model_ns, search_ns, status, bt, counted.calls
+
+
+statuses = {True: "solved", False: "unsat", None: "limit"}
+
+suite_fields = ["board", "size", "numtree", "model", "priority", "propagator",
+                "heuristic", "search", "status", "reps", "model_ns_median",
+                "model_ns_iqr", "search_ns_median", "search_ns_iqr",
+                "decisions", "prunings", "propagator_calls"]
+
+
+def measure(name, config, reps=5, warmup=1, limit=None):
+    """
+    Run config on board name warmup times untimed, then reps times, and
+    return the record of suite_fields. Decisions, prunings and calls are
+    the same in every run so they are given once.
+    """
+    board, numtree = testboards[name]
+    for i in range(warmup):
+        run_config(board, numtree, config, limit)
+    model_ns = []
+    search_ns = []
+    for i in range(reps):
+        build, search, status, bt, calls = run_config(board, numtree,
+                                                      config, limit)
+        model_ns.append(build)
+        search_ns.append(search)
+    record = dict(zip(suite_fields[3:8], config))
+    record.update(board=name, size=len(board), numtree=numtree,
+                  status=statuses[status], reps=reps,
+                  decisions=bt.nDecisions, prunings=bt.nPrunings,
+                  propagator_calls=calls)
+    record["model_ns_median"], record["model_ns_iqr"] = median_iqr(model_ns)
+    record["search_ns_median"], record["search_ns_iqr"] = median_iqr(search_ns)
+    return {field: record[field] for field in suite_fields}
+
+
+def bench_suite(names=list(testboards), configs=default_configs, reps=5,
+                warmup=1, limit=10000, json_path="bench_suite.json",
+                csv_path="bench_suite.csv"):
+    """
+    measure every board x configuration, print a line for each and
+    write all records to json_path and csv_path (None: do not write).
+    Searches are cut off after limit propagator calls (status "limit"),
+    neither 20x20 board finishes with every configuration.
+    """
+    print("{:20} {:45} {:>7} {:>11} {:>11} {:>9} {:>9}".format(
+        "board", "configuration", "status", "model(ms)", "search(ms)",
+        "nodes", "calls"))
+    records = []
+    for name in names:
+        for config in configs:
+            r = measure(name, config, reps, warmup, limit)
+            records.append(r)
+            print("{:20} {:45} {:>7} {:>11} {:>11} {:>9} {:>9}".format(
+                name, "/".join(str(c) for c in config), r["status"],
+                "{:.2f}±{:.2f}".format(r["model_ns_median"] / 1e6,
+                                       r["model_ns_iqr"] / 1e6),
+                "{:.2f}±{:.2f}".format(r["search_ns_median"] / 1e6,
+                                       r["search_ns_iqr"] / 1e6),
+                r["decisions"], r["propagator_calls"]))
+    if json_path is not None:
+        with open(json_path, "w") as f:
+            json.dump(records, f, indent=1)
+    if csv_path is not None:
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=suite_fields)
+            writer.writeheader()
+            writer.writerows(records)
+    return records
+
+
+benchmarks = {
+    "adjacency": bench_adjacency,
+    "backjumping": bench_backjumping,
+    "bitboard": bench_bitboard,
+    "dlx": bench_dlx,
+    "domains": bench_domains,
+    "engines": bench_engines,
+    "learning": bench_learning,
+    "models": bench_models,
+    "parallel": bench_parallel,
+    "queues": bench_queues,
+    "regions": bench_regions,
+    "suite": bench_suite,
+    "values": bench_values,
+    "wdeg": bench_wdeg,
+}
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:] or list(benchmarks):
+        benchmarks[arg]()
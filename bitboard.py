@@ -0,0 +1,180 @@
+import time
+
+"""
+Bitboard engine for the alberi puzzle, an alternative to building a CSP
+with model.py and searching it with BT.
+
+Cell (r, c) of an n by n board is bit r*n + c of a Python int, so a row,
+a column, a park or the 8 neighbours of a cell are each one int mask. A
+search state is just two masks:
+    trees - cells holding a tree
+    cand  - cells that can still get one
+Placing a tree clears the cell and its neighbourhood from cand; counting
+the trees or candidates of a region is a popcount of an AND.
+
+Propagation repeats until nothing changes: a region (row, column or park)
+with numtree trees loses its other candidates, a region whose trees plus
+candidates make exactly numtree gets all of them as trees, and a region
+with too many trees or too few places left is a deadend. Search branches
+on the first candidate of the region with the fewest spare candidates
+(candidates beyond the trees it still needs): tree there, or no tree
+there. Because a state is two ints, the search stack
+holds states and backtracking is popping one, there is nothing to undo.
+"""
+
+try:
+    popcount = int.bit_count
+except AttributeError:          #before python 3.10
+    def popcount(x):
+        return bin(x).count("1")
+
+
+class BitboardSolver:
+    """
+    Takes the same input as alberi_model_1 (an n by n list of park
+    labels) and numtree. solve() searches for a solution and returns
+    True/False; nDecisions and nPrunings count like BT's, grid() and
+    print_solution() give the answer in AlberiSolver's format.
+    """
+
+    def __init__(self, board, numtree):
+        self.board = board
+        self.numtree = numtree
+        self.dim = n = len(board)
+        self.rows = [((1 << n) - 1) << (r * n) for r in range(n)]
+        col = sum(1 << (r * n) for r in range(n))
+        self.cols = [col << c for c in range(n)]
+        parks = dict()
+        for r in range(n):
+            for c in range(n):
+                parks[board[r][c]] = parks.get(board[r][c], 0) | 1 << (r * n + c)
+        self.parks = list(parks.values())
+        self.regions = self.parks + self.rows + self.cols
+        # neighbours[i] = cell i and its (up to) 8 neighbours, made of the
+        # 3 cell wide strip around column c in rows r-1 to r+1
+        strips = [((7 << c) >> 1) & ((1 << n) - 1) for c in range(n)]
+        self.neighbours = []
+        for r in range(n):
+            above = max(r - 1, 0) * n
+            below = min(r + 2, n) * n
+            for c in range(n):
+                mask = 0
+                for shift in range(above, below, n):
+                    mask |= strips[c] << shift
+                self.neighbours.append(mask)
+        self.full = (1 << (n * n)) - 1
+        self.solution = None
+        self.nDecisions = 0
+        self.nPrunings = 0
+        self.runtime = 0
+
+    def propagate(self, trees, cand):
+        """
+        Apply the counting rules to every region until nothing changes.
+        Return the new (trees, cand), or None on a deadend.
+        """
+        k = self.numtree
+        regions = self.regions
+        neighbours = self.neighbours
+        changed = True
+        while changed:
+            changed = False
+            for region in regions:
+                t = popcount(trees & region)
+                left = cand & region
+                p = popcount(left)
+                if t > k or t + p < k:
+                    return None
+                if p == 0:
+                    continue
+                if t == k:
+                    # region full, no more trees in it
+                    cand &= ~region
+                    self.nPrunings += p
+                    changed = True
+                elif t + p == k:
+                    # every candidate left must be a tree
+                    while left:
+                        bit = left & -left
+                        left &= ~bit
+                        if not cand & bit:
+                            # cleared by a tree placed just before it,
+                            # the recount on the next pass fails
+                            continue
+                        removed = cand & neighbours[bit.bit_length() - 1]
+                        self.nPrunings += popcount(removed) - 1
+                        trees |= bit
+                        cand &= ~removed
+                    changed = True
+        return trees, cand
+
+    def pick(self, trees, cand):
+        """the candidate cell to branch on: the first candidate of the
+        unfinished region with the fewest spare candidates, None if all
+        regions have their trees"""
+        k = self.numtree
+        best = None
+        fewest = self.full
+        for region in self.regions:
+            t = popcount(trees & region)
+            if t < k:
+                p = popcount(cand & region) - (k - t)
+                if p < fewest:
+                    fewest = p
+                    best = region
+        if best is None:
+            return None
+        left = cand & best
+        return (left & -left).bit_length() - 1
+
+    def solve(self):
+        """Search for a solution, return True if there is one"""
+        self.nDecisions = 0
+        self.nPrunings = 0
+        self.solution = None
+        start = time.perf_counter()
+        # each state is (trees, cand, decided), decided False only for
+        # the root: a decision is counted when its state is searched,
+        # like BT counts an assignment when it makes it
+        stack = [(0, self.full, False)]
+        while stack:
+            trees, cand, decided = stack.pop()
+            if decided:
+                self.nDecisions += 1
+            state = self.propagate(trees, cand)
+            if state is None:
+                continue
+            trees, cand = state
+            cell = self.pick(trees, cand)
+            if cell is None:
+                self.solution = trees
+                break
+            bit = 1 << cell
+            # no tree on cell is pushed first so the tree is tried first
+            stack.append((trees, cand & ~bit, True))
+            removed = cand & self.neighbours[cell]
+            self.nPrunings += popcount(removed) - 1
+            stack.append((trees | bit, cand & ~removed, True))
+        self.runtime = time.perf_counter() - start
+        return self.solution is not None
+
+    def grid(self):
+        """the solution as rows of 0/1, like AlberiSolver's varlist values"""
+        n = self.dim
+        trees = self.solution or 0
+        return [[(trees >> (r * n + c)) & 1 for c in range(n)]
+                for r in range(n)]
+
+    def print_solution(self):
+        for row in self.grid():
+            print(row)
+
+    def run(self):
+        print("Puzzle: {} by {}, {} trees".format(self.dim, self.dim, self.numtree))
+        if self.solve():
+            print("Bitboard search solved. Time used = {}".format(self.runtime))
+        else:
+            print("Bitboard search unsolved. Has no solutions")
+        print("Search made {} decisions and pruned {} candidates".format(
+            self.nDecisions, self.nPrunings))
+        self.print_solution()
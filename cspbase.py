@@ -1,5 +1,15 @@
 import time
 import functools
+import heapq
+import math
+import multiprocessing
+import os
+import random
+from collections import deque
+try:
+    import resource
+except ImportError:
+    resource = None
 
 '''Constraint Satisfaction Routines
    A) class Variable
@@ -11,7 +21,7 @@ import functools
       added but NOT deleted from.
       
       To support constraint propagation, the class also maintains a
-      set of flags to indicate if a value is still in its current domain.
+      bitmask to indicate if a value is still in its current domain.
       So one can remove values, add them back, and query if they are 
       still current. 
 
@@ -34,6 +44,10 @@ import functools
        so that basic backtracking, forward-checking or GAC can be 
        executed depending on the propagator used.
 
+       Changes made during search (assignments and prunings) are
+       pushed onto a Trail, an undo stack with level markers, so that
+       backtracking is popping the trail back to the last marker.
+
 '''
 
 class Variable: 
@@ -45,8 +59,9 @@ class Variable:
 
        The variable object offers two types of functionality to support
        search. 
-       (a) It has a current domain, implimented as a set of flags 
-           determining which domain values are "current", i.e., unpruned.
+       (a) It has a current domain, implimented as an integer bitmask
+           with one bit per domain value determining which domain values
+           are "current", i.e., unpruned.
            - you can prune a value, and restore it.
            - you can obtain a list of values in the current domain, or count
              how many are still there
@@ -80,17 +95,32 @@ class Variable:
         string). Optionally specify the initial domain.
         '''
         self.name = name                #text name for variable
-        self.dom = list(domain)         #Make a copy of passed domain
-        self.curdom = [True] * len(domain)      #using list
+        self.dom = []
+        self.bits = dict()              #value -> bit of that value in curmask
+        self.curmask = 0                #current domain as an integer bitmask
+        self.fullmask = 0               #mask with every domain value set
+        self.vals_of_mask = dict()      #mask -> tuple of values, built lazily
+        #constraints over this variable (the CSP's var->constraint index),
+        #their counters are kept up to date by assign/unassign/prune
+        self.cons = []
+        #VarBuckets to tell when the current domain changes size (MRV)
+        self.selector = None
+        #ConBuckets to tell when this variable is assigned/unassigned (MAV)
+        self.con_buckets = None
         #for bt_search
         self.assignedValue = None
+        self.add_domain_values(domain)
 
     def add_domain_values(self, values):
         '''Add additional domain values to the domain
            Removals not supported removals'''
         for val in values: 
+            bit = 1 << len(self.dom)
             self.dom.append(val)
-            self.curdom.append(True)
+            self.bits[val] = bit
+            self.fullmask |= bit
+            self.curmask |= bit
+        self.vals_of_mask = dict()
 
     def domain_size(self):
         '''Return the size of the (permanent) domain'''
@@ -106,53 +136,79 @@ class Variable:
 
     def prune_value(self, value):
         '''Remove value from CURRENT domain'''
-        self.curdom[self.value_index(value)] = False
+        bit = self.bits[value]
+        if self.curmask & bit:
+            self.curmask &= ~bit
+            if value == 1 and self.assignedValue is None:
+                self.count_ones(-1)
+            if self.selector is not None:
+                self.selector.moved(self)
 
     def unprune_value(self, value):
         '''Restore value to CURRENT domain'''
-        self.curdom[self.value_index(value)] = True
+        bit = self.bits[value]
+        if not self.curmask & bit:
+            self.curmask |= bit
+            if value == 1 and self.assignedValue is None:
+                self.count_ones(1)
+            if self.selector is not None:
+                self.selector.moved(self)
 
     def cur_domain(self):
         '''return list of values in CURRENT domain (if assigned 
            only assigned value is viewed as being in current domain)'''
-        vals = []
+        return list(self.cur_values())
+
+    def cur_values(self):
+        '''return the values in CURRENT domain as a shared tuple. Same
+           view as cur_domain but nothing is allocated once the tuple for
+           a given mask has been built, so use this one to iterate'''
         if self.is_assigned():
-            vals.append(self.get_assigned_value())
-        else:
-            for i, val in enumerate(self.dom):
-                if self.curdom[i]:
-                    vals.append(val)
+            return self.values_of(self.bits[self.assignedValue])
+        return self.values_of(self.curmask)
+
+    def values_of(self, mask):
+        '''return tuple of domain values whose bits are set in mask'''
+        vals = self.vals_of_mask.get(mask)
+        if vals is None:
+            vals = tuple(val for val in self.dom if mask & self.bits[val])
+            self.vals_of_mask[mask] = vals
         return vals
 
     def in_cur_domain(self, value):
         '''check if value is in CURRENT domain (without constructing list)
            if assigned only assigned value is viewed as being in current 
            domain'''
-        if not value in self.dom:
+        bit = self.bits.get(value)
+        if bit is None:
             return False
         if self.is_assigned():
-            return value == self.get_assigned_value()
-        else:
-            return self.curdom[self.value_index(value)]
+            return value == self.assignedValue
+        return self.curmask & bit != 0
 
     def cur_domain_size(self):
         '''Return the size of the variables domain (without construcing list)'''
         if self.is_assigned():
             return 1
-        else:
-            return(sum(1 for v in self.curdom if v))
+        return len(self.values_of(self.curmask))
 
     def restore_curdom(self):
         '''return all values back into CURRENT domain'''
-        for i in range(len(self.curdom)):
-            self.curdom[i] = True
+        for val in self.dom:
+            self.unprune_value(val)
+
+    @property
+    def curdom(self):
+        '''flags telling which domain values are in the CURRENT domain
+           (internal state, ignores assignment), kept for old callers'''
+        return [self.curmask & self.bits[val] != 0 for val in self.dom]
 
     #
     #methods for assigning and unassigning
     #
 
     def is_assigned(self):
-        return self.assignedValue != None
+        return self.assignedValue is not None
     
     def assign(self, value):
         '''Used by bt_search. When we assign we remove all other values
@@ -165,13 +221,28 @@ class Variable:
             return
 
         self.assignedValue = value
+        ones = (value == 1) - self.has_value(1)
+        for c in self.cons:
+            c.n_asgn += 1
+            c.sum_asgn += value
+            c.n_possible += ones
+        if self.con_buckets is not None:
+            self.con_buckets.moved(self)
 
     def unassign(self):
         '''Used by bt_search. Unassign and restore old curdom'''
         if not self.is_assigned():
             print("ERROR: trying to unassign variable", self, " not yet assigned")
             return
+        value = self.assignedValue
         self.assignedValue = None
+        ones = self.has_value(1) - (value == 1)
+        for c in self.cons:
+            c.n_asgn -= 1
+            c.sum_asgn -= value
+            c.n_possible += ones
+        if self.con_buckets is not None:
+            self.con_buckets.moved(self)
 
     def get_assigned_value(self):
         '''return assigned value...returns None if is unassigned'''
@@ -184,7 +255,18 @@ class Variable:
     def value_index(self, value):
         '''Domain values need not be numbers, so return the index
            in the domain list of a variable value'''
-        return self.dom.index(value)
+        return self.bits[value].bit_length() - 1
+
+    def has_value(self, value):
+        '''1 if value is in the internal current domain (ignoring any
+           assignment), else 0'''
+        return 1 if self.curmask & self.bits.get(value, 0) else 0
+
+    def count_ones(self, delta):
+        '''value 1 entered (delta=1) or left (delta=-1) the current
+           domain of this unassigned variable, tell its constraints'''
+        for c in self.cons:
+            c.n_possible += delta
 
     def __repr__(self):
         return "Var-{}".format(self.name)
@@ -197,6 +279,89 @@ class Variable:
         print("Var--\"{}\": Dom = {}, CurDom = {}".format(self.name, 
                                                              self.dom, 
                                                              self.curdom))
+
+
+class ListVariable(Variable):
+    '''The original list based current domain: dom is a list and
+       curdom a list of flags, so every prune/unprune/membership test
+       goes through dom.index and cur_domain builds a new list.
+       Kept so benchmark.py can compare it against the bitmask version.'''
+
+    def __init__(self, name, domain=[]):
+        self.name = name
+        self.dom = list(domain)
+        self.flags = [True] * len(domain)
+        self.cons = []
+        self.selector = None
+        self.con_buckets = None
+        self.assignedValue = None
+
+    def add_domain_values(self, values):
+        for val in values: 
+            self.dom.append(val)
+            self.flags.append(True)
+
+    def prune_value(self, value):
+        i = self.value_index(value)
+        if self.flags[i]:
+            self.flags[i] = False
+            if value == 1 and not self.is_assigned():
+                self.count_ones(-1)
+            if self.selector is not None:
+                self.selector.moved(self)
+
+    def unprune_value(self, value):
+        i = self.value_index(value)
+        if not self.flags[i]:
+            self.flags[i] = True
+            if value == 1 and not self.is_assigned():
+                self.count_ones(1)
+            if self.selector is not None:
+                self.selector.moved(self)
+
+    def cur_domain(self):
+        vals = []
+        if self.is_assigned():
+            vals.append(self.get_assigned_value())
+        else:
+            for i, val in enumerate(self.dom):
+                if self.flags[i]:
+                    vals.append(val)
+        return vals
+
+    def cur_values(self):
+        return self.cur_domain()
+
+    def in_cur_domain(self, value):
+        if not value in self.dom:
+            return False
+        if self.is_assigned():
+            return value == self.get_assigned_value()
+        else:
+            return self.flags[self.value_index(value)]
+
+    def cur_domain_size(self):
+        if self.is_assigned():
+            return 1
+        else:
+            return(sum(1 for v in self.flags if v))
+
+    def restore_curdom(self):
+        for val in self.dom:
+            self.unprune_value(val)
+
+    @property
+    def curdom(self):
+        return list(self.flags)
+
+    def value_index(self, value):
+        return self.dom.index(value)
+
+    def has_value(self, value):
+        if value in self.dom and self.flags[self.value_index(value)]:
+            return 1
+        return 0
+
 class Constraint: 
     '''Class for defining constraints variable objects specifes an
        ordering over variables.  This ordering is used when calling
@@ -218,6 +383,7 @@ class Constraint:
         - c: colum constraint/row constraint
         - p: park constraint
         - a: adjacent pair constraint
+        - t: the global no touch constraint (see NoTouchConstraint)
 
         NOTE: This is a very space expensive representation...a proper
         constraint object would allow for representing the constraint
@@ -228,7 +394,19 @@ class Constraint:
         self.name = name
         self.numtree = numtree
         self.type = constraint_type
-        # type takes "a" - "adjacency" or "o" -"others (park/column/row)"
+        self.queued = False     #on the CSP's RevisionQueue
+        #bumped by BT each time the constraint causes a deadend (dom/wdeg)
+        self.weight = 1
+        # type takes "a" - "adjacency", "o" -"others (park/column/row)" or
+        # "t" - "no touch, the whole grid"
+
+        # Counters over the scope, kept up to date by Variable.assign,
+        # unassign and prune_value once the constraint is in a CSP:
+        #   n_asgn     - number of assigned variables
+        #   sum_asgn   - sum of the assigned values (the trees placed)
+        #   n_possible - number of variables that can still be 1, i.e.
+        #                have 1 in their current domain (assigned 1s included)
+        self.recount()
         #self.sat_tuples = dict()
         
         #The next object data item 'sup_tuples' will be used to help
@@ -275,13 +453,29 @@ class Constraint:
         # If type = a, sum of vals <= 1
         return num <= 1
 
+    def recount(self):
+        '''recompute the counters from the current state of the scope'''
+        self.n_asgn = 0
+        self.sum_asgn = 0
+        self.n_possible = 0
+        for v in self.scope:
+            if v.is_assigned():
+                self.n_asgn += 1
+                self.sum_asgn += v.get_assigned_value()
+            if v.in_cur_domain(1):
+                self.n_possible += 1
+
+    def consistent(self):
+        '''return true if the assigned variables do not violate the
+           constraint yet. Once the whole scope is assigned this is the
+           same answer as check on the assigned values'''
+        if self.type == 'o':
+            return self.sum_asgn <= self.numtree <= self.n_possible
+        return self.sum_asgn <= 1
+
     def get_n_unasgn(self):
         '''return the number of unassigned variables in the constraint's scope'''
-        n = 0
-        for v in self.scope:
-            if not v.is_assigned():
-                n = n + 1
-        return n
+        return len(self.scope) - self.n_asgn
 
     def get_unasgn_vars(self): 
         '''return list of unassigned variables in constraint's scope. Note
@@ -296,44 +490,172 @@ class Constraint:
         '''Test if a variable value pair has a supporting tuple (a set
            of assignments satisfying the constraint where each value is
            still in the corresponding variables current domain
-        '''
-        if val == 0:
-            # If val = 0:
-            if self.type == 'o':
-                # If type = o, get all assigned variables, add them together
-                cursum = 0
-                for var in self.scope:
-                    if var.is_assigned():
-                        cursum += var.get_assigned_value()
-                # then add get_n_unassign. Return true iff result >= numtree
-                cursum += self.get_n_unasgn()
-                return cursum > self.numtree
-            else:
-                # If type = a, return true. Adjacency constraints cannot be violated by assigning 0
-                return True
-        else:
-            # calculate the number of variables assigned to 1
-            cursum = 0
-            for var in self.scope:
-                if var.is_assigned():
-                    cursum += var.get_assigned_value()
-            # If val = 1:
-            if self.type == 'o':
-                # If type = o, get all assigned variables. If their sum + 1 > numtree,
-                # return false. Otherwise return true.
-                return (cursum + 1) <= self.numtree
 
-            else:
-                # If type = a, if any other assigned variables are assigned to 1,
-                # return false, otherwise return true.
-                return cursum == 0
+           Constant time from the counters: the other variables can
+           contribute between their assigned sum and the number of them
+           that can still be 1.
+        '''
+        # sum and possible ones of the other variables in the scope
+        cursum = self.sum_asgn
+        if var.is_assigned():
+            cursum -= var.get_assigned_value()
+        possible = self.n_possible
+        if var.in_cur_domain(1):
+            possible -= 1
 
+        if self.type == 'o':
+            # If type = o, the others must be able to make up the rest
+            # of numtree without going over it
+            need = self.numtree - val
+            return cursum <= need <= possible
+        # If type = a, at most one tree in the scope
+        return cursum + val <= 1
+
+    def explain(self, val, ones, zeros):
+        '''Why a variable of the scope cannot take val, or (val None)
+           why the constraint is violated. ones and zeros hold, for each
+           other variable of the scope already known to be a tree/not a
+           tree, the trail positions of the facts saying so. Return the
+           positions of just enough of them (the earliest) to rule val
+           out, None if they do not'''
+        n = len(self.scope) - (val is not None)
+        add = val or 0
+        if self.type == 'o':
+            most = least = self.numtree
+        else:
+            most, least = 1, 0
+        if len(ones) + add > most:
+            groups, k = ones, most - add + 1
+        elif n - len(zeros) + add < least:
+            groups, k = zeros, n - least + add + 1
+        else:
+            return None
+        return [p for g in sorted(groups, key=max)[:k] for p in g]
 
+    def support(self, var):
+        '''the variables of the scope whose state can rule a value of
+           var out (var None: violate the constraint), for explain'''
+        return self.scope
 
     def __str__(self):
         return "{}({})".format(self.name, [var.name for var in self.scope])
 
 
+class NoTouchConstraint(Constraint):
+    '''The "no two trees touch" rule of a whole n by n grid of
+       variables as one constraint of type 't' (alberi_model_3). It
+       knows the geometry: neighbours[var] are the (up to 8) cells
+       around var. A tree takes 1 out of its neighbours in one step
+       (see propagators.py) instead of waking the many small adjacency
+       constraints of alberi_model_1 and alberi_model_2. Propagators
+       finding a tree touching another one set clash to it, which keeps
+       the explanation of the violation to its neighbourhood.'''
+
+    def __init__(self, name, grid, numtree):
+        Constraint.__init__(self, name, [v for row in grid for v in row],
+                            't', numtree)
+        n = len(grid)
+        self.neighbours = dict()
+        for r in range(n):
+            for c in range(n):
+                self.neighbours[grid[r][c]] = [
+                    grid[i][j]
+                    for i in range(max(r - 1, 0), min(r + 2, n))
+                    for j in range(max(c - 1, 0), min(c + 2, n))
+                    if (i, j) != (r, c)]
+        self.clash = None
+
+    def check(self, vals):
+        trees = set(v for v, val in zip(self.scope, vals) if val == 1)
+        return not any(y in trees for v in trees for y in self.neighbours[v])
+
+    def consistent(self):
+        for v in self.scope:
+            if v.get_assigned_value() == 1:
+                for y in self.neighbours[v]:
+                    if y.get_assigned_value() == 1:
+                        return False
+        return True
+
+    def has_support(self, var, val):
+        '''var can be a tree if none of its neighbours has to be one'''
+        if val != 1:
+            return True
+        for y in self.neighbours[var]:
+            if not y.in_cur_domain(0):
+                return False
+        return True
+
+    def support(self, var):
+        if var is None:
+            if self.clash is None:
+                return self.scope
+            return [self.clash] + self.neighbours[self.clash]
+        return self.neighbours[var]
+
+    def explain(self, val, ones, zeros):
+        '''A tree among the neighbours rules out 1. A violation is
+           explained by all the trees of support(None), they include
+           the touching pair'''
+        if val == 1 and ones:
+            return min(ones, key=max)
+        if val is None and len(ones) > 1:
+            return [p for g in ones for p in g]
+        return None
+
+
+class RevisionQueue:
+    '''Queue of constraints to revise, shared by the GAC style
+       propagators through csp.queue. A constraint's queued flag says
+       whether it is already waiting, so pushing is O(1) and never adds
+       a duplicate. policy "LIFO" revises the most recently queued
+       constraint first (what the old list.pop() did), "FIFO" the
+       oldest. revisions counts the constraints popped since creation.
+       budget is the Budget of the running search, ticked per pop.'''
+
+    def __init__(self, policy="LIFO"):
+        if policy not in ("LIFO", "FIFO"):
+            raise ValueError("unknown queue policy {}".format(policy))
+        self.policy = policy
+        self.lifo = policy == "LIFO"
+        self.items = deque()
+        self.revisions = 0
+        self.budget = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def push(self, c):
+        '''queue c unless it is already waiting'''
+        if not c.queued:
+            c.queued = True
+            self.items.append(c)
+
+    def extend(self, cons):
+        for c in cons:
+            if not c.queued:
+                c.queued = True
+                self.items.append(c)
+
+    def pop(self):
+        '''take the next constraint to revise'''
+        if self.lifo:
+            c = self.items.pop()
+        else:
+            c = self.items.popleft()
+        c.queued = False
+        self.revisions += 1
+        if self.budget is not None:
+            self.budget.tick()
+        return c
+
+    def clear(self):
+        '''drop whatever is left, e.g. after a propagator failed'''
+        for c in self.items:
+            c.queued = False
+        self.items.clear()
+
+
 class CSP:
     '''Class for packing up a set of variables into a CSP problem.
        Contains various utility routines for accessing the problem.
@@ -348,24 +670,34 @@ class CSP:
         self.vars = []
         self.cons = []
         self.vars_to_cons = dict()
+        #set by bt_search while it runs, propagators prune through it
+        self.trail = None
+        #constraints waiting for revision inside GAC style propagators
+        self.queue = RevisionQueue()
+        #the board, for propagators reasoning on it (see set_grid)
+        self.grid = None
+        self.parks = []
         for v in vars:
             self.add_var(v)
 
     def add_var(self,v):
         '''Add variable object to CSP while setting up an index
-           to obtain the constraints over this variable'''
-        if not type(v) is Variable:
+           to obtain the constraints over this variable. The index list
+           is shared with the variable (v.cons) so it can keep the
+           constraint counters up to date'''
+        if not isinstance(v, Variable):
             print("Trying to add non variable ", v, " to CSP object")
         elif v in self.vars_to_cons:
             print("Trying to add variable ", v, " to CSP object that already has it")
         else:
             self.vars.append(v)
-            self.vars_to_cons[v] = []
+            v.cons = []
+            self.vars_to_cons[v] = v.cons
 
     def add_constraint(self,c):
         '''Add constraint to CSP. Note that all variables in the 
            constraints scope must already have been added to the CSP'''
-        if not type(c) is Constraint:
+        if not isinstance(c, Constraint):
             print("Trying to add non constraint ", c, " to CSP object")
         else:
             for v in c.scope:
@@ -373,6 +705,7 @@ class CSP:
                     print("Trying to add constraint ", c, " with unknown variables to CSP object")
                     return
                 self.vars_to_cons[v].append(c)
+            c.recount()
             self.cons.append(c)
 
     def get_all_cons(self):
@@ -387,6 +720,40 @@ class CSP:
         '''return list of variables in the CSP'''
         return list(self.vars)
 
+    def set_grid(self, grid, parks):
+        '''Tell propagators that reason on the board (prop_region) where
+           the variables are: grid is the rows of cell variables, parks
+           the park constraints. park_of and cell_of map a variable to
+           its park number and its (row, column)'''
+        self.grid = grid
+        self.parks = list(parks)
+        self.park_of = dict()
+        for p, c in enumerate(self.parks):
+            for v in c.scope:
+                self.park_of[v] = p
+        self.cell_of = dict()
+        for r, row in enumerate(grid):
+            for col, v in enumerate(row):
+                self.cell_of[v] = (r, col)
+
+    def reset_weights(self):
+        '''Forget what the searches learned on the constraint weights'''
+        for c in self.cons:
+            c.weight = 1
+
+    def set_queue_policy(self, policy):
+        '''Order in which propagators revise queued constraints,
+           "LIFO" (the default) or "FIFO"'''
+        self.queue = RevisionQueue(policy)
+
+    def pruner(self):
+        '''return the object propagators should prune values through:
+           the search trail while bt_search runs, otherwise a fresh
+           PruneList (the old list of (Variable, Value) pairs)'''
+        if self.trail is not None:
+            return self.trail
+        return PruneList()
+
     def print_all(self):
         print("CSP", self.name)
         print("   Variables = ", self.vars)
@@ -403,6 +770,891 @@ class CSP:
 # Backtracking Routine                                 #
 ########################################################
 
+class PruneList(list):
+    '''List of (Variable, Value) pairs pruned by a propagator. This is
+       what propagators return when they are run outside bt_search'''
+
+    def prune(self, var, val, reason=None):
+        '''Prune val from var and remember the pair'''
+        var.prune_value(val)
+        self.append((var, val))
+
+    def fail(self, reason, var=None):
+        '''A deadend, only the search trail keeps its reason'''
+
+
+ASSIGNED = object()     #trail entry value marking an assignment
+
+
+class Trail:
+    '''Undo stack shared by BT and the propagators. Every assignment
+       and every pruning made during search is pushed as a (var, val)
+       entry; push_level marks the start of a search node and
+       pop_level undoes everything done since the matching mark.
+
+       The entry arrays are allocated once, large enough for a full
+       path of the search (every value pruned and every variable
+       assigned), so deep searches do not allocate per node.'''
+
+    def __init__(self, capacity=0):
+        self.tvars = [None] * capacity
+        self.tvals = [None] * capacity
+        self.top = 0            #number of entries in use
+        self.levels = []        #value of top at each push_level
+        self.nPruned = 0        #prunings pushed since creation/clear
+        self.failed = None      #reason given to the last fail
+
+    def __len__(self):
+        return self.top
+
+    def push(self, var, val):
+        '''Push an entry, growing the arrays if they are full'''
+        i = self.top
+        if i == len(self.tvars):
+            self.tvars.append(var)
+            self.tvals.append(val)
+        else:
+            self.tvars[i] = var
+            self.tvals[i] = val
+        self.top = i + 1
+
+    def prune(self, var, val, reason=None):
+        '''Prune val from var and record it. reason is the constraint
+           (or nogood) that forced the pruning, kept by a ReasonTrail'''
+        var.prune_value(val)
+        self.push(var, val)
+        self.nPruned += 1
+
+    def fail(self, reason, var=None):
+        '''A propagator found a deadend: reason (a constraint or a
+           nogood) is violated, or it emptied the domain of var. Only a
+           ReasonTrail keeps this, for analysis; failed is the reason of
+           the last deadend either way'''
+        self.failed = reason
+
+    def record(self, prunings):
+        '''Record (var, val) pairs somebody else already pruned. This
+           is the shim for propagators that return a list of prunings'''
+        for var, val in prunings:
+            self.push(var, val)
+            self.nPruned += 1
+
+    def assign(self, var, val):
+        '''Assign val to var and record it'''
+        var.assign(val)
+        self.push(var, ASSIGNED)
+
+    def push_level(self):
+        '''Mark the start of a new search node'''
+        self.levels.append(self.top)
+
+    def pop_level(self):
+        '''Undo everything recorded since the last push_level'''
+        self.undo(self.levels.pop())
+
+    def undo(self, mark):
+        '''Undo entries until only mark of them are left'''
+        tvars = self.tvars
+        tvals = self.tvals
+        i = self.top
+        while i > mark:
+            i -= 1
+            var = tvars[i]
+            val = tvals[i]
+            if val is ASSIGNED:
+                var.unassign()
+            else:
+                var.unprune_value(val)
+        self.top = i
+
+    def since(self, mark):
+        '''return the prunings recorded after mark (for tracing)'''
+        return [(self.tvars[i], self.tvals[i]) for i in range(mark, self.top)
+                if self.tvals[i] is not ASSIGNED]
+
+    def clear(self):
+        '''Forget all entries without undoing them'''
+        self.top = 0
+        self.levels = []
+        self.nPruned = 0
+
+
+class ReasonTrail(Trail):
+    '''Trail for nogood learning. Besides the entries it keeps
+       - treasons: the reason of each pruning (the constraint or nogood
+         passed to prune, None for assignments and recorded lists)
+       - where: var -> positions of the latest pruning of each of its
+         values (in domain order) and, last, of its latest assignment.
+         They are not reset on undo, so a position is only trusted if
+         the entry there is still the same fact
+       - conflict: (reason, var) of the last fail(), None if no
+         propagator said why it failed'''
+
+    def __init__(self, capacity=0):
+        Trail.__init__(self, capacity)
+        self.treasons = [None] * capacity
+        self.where = dict()
+        self.conflict = None
+
+    def push(self, var, val, reason=None):
+        i = self.top
+        Trail.push(self, var, val)
+        if i == len(self.treasons):
+            self.treasons.append(reason)
+        else:
+            self.treasons[i] = reason
+        w = self.where.get(var)
+        if w is None:
+            w = self.where[var] = [-1] * (len(var.dom) + 1)
+        w[-1 if val is ASSIGNED else var.value_index(val)] = i
+
+    def prune(self, var, val, reason=None):
+        var.prune_value(val)
+        self.push(var, val, reason)
+        self.nPruned += 1
+
+    def fail(self, reason, var=None):
+        self.conflict = (reason, var)
+        self.failed = reason
+
+    def clear(self):
+        Trail.clear(self)
+        self.where = dict()
+        self.conflict = None
+
+    def position(self, var, val, before):
+        '''position of the fact (var, val) if it is on the trail below
+           position before, else None'''
+        w = self.where.get(var)
+        if w is None:
+            return None
+        i = w[-1 if val is ASSIGNED else var.value_index(val)]
+        if 0 <= i < before and self.tvars[i] is var and self.tvals[i] == val:
+            return i
+        return None
+
+    def holds(self, var, val, before):
+        '''positions of the facts making var = val below position
+           before: its assignment, or the prunings of every other value.
+           None if var = val did not hold yet'''
+        i = self.position(var, ASSIGNED, before)
+        if i is not None:
+            return [i] if var.get_assigned_value() == val else None
+        facts = []
+        for other in var.dom:
+            if other != val:
+                i = self.position(var, other, before)
+                if i is None:
+                    return None
+                facts.append(i)
+        return facts
+
+    def removed(self, var, val, before):
+        '''position of the fact ruling out var = val below position
+           before: the pruning of val, or var assigned another value.
+           None if val was still possible'''
+        i = self.position(var, val, before)
+        if i is None:
+            i = self.position(var, ASSIGNED, before)
+            if i is not None and var.get_assigned_value() == val:
+                i = None
+        return i
+
+    def facts(self, reason, var, val, before):
+        '''positions of the facts (below position before) that made
+           reason rule out var = val, or made it fail when var is None'''
+        if isinstance(reason, Nogood):
+            reason.activity += 1
+            facts = []
+            for y, u in reason.lits:
+                if y is not var:
+                    f = self.holds(y, u, before)
+                    if f is None:
+                        return None
+                    facts.extend(f)
+            return facts
+        if isinstance(reason, Constraint):
+            #self.holds(y, 1) and self.removed(y, 1) for every other
+            #variable y, written out as this is where learning spends
+            #its time
+            where = self.where
+            tvars = self.tvars
+            tvals = self.tvals
+            ones = []
+            zeros = []
+            for y in reason.support(var):
+                w = where.get(y)
+                if y is var or w is None:
+                    continue
+                i = w[-1]
+                if 0 <= i < before and tvars[i] is y and tvals[i] is ASSIGNED:
+                    if y.get_assigned_value() == 1:
+                        ones.append([i])
+                    else:
+                        zeros.append([i])
+                    continue
+                one = []    #prunings of the values other than 1
+                for k, u in enumerate(y.dom):
+                    i = w[k]
+                    pruned = 0 <= i < before and tvars[i] is y and tvals[i] == u
+                    if u == 1:
+                        if pruned:
+                            zeros.append([i])
+                    elif pruned and one is not None:
+                        one.append(i)
+                    else:
+                        one = None
+                if one:
+                    ones.append(one)
+            return reason.explain(val, ones, zeros)
+        return None
+
+    def analyse(self, root, facts=None):
+        '''The decisions behind the facts at the given positions (by
+           default the deadend in self.conflict): follow the reasons of
+           the prunings involved back to the decisions they came from.
+           An assignment whose other values were all pruned first is not
+           a decision and is followed too; facts below root (the root
+           propagation) always hold and are left out. Return the list of
+           (var, val) decisions, None if some pruning has no reason'''
+        if facts is None:
+            if self.conflict is None:
+                return None
+            reason, var = self.conflict
+            if var is not None:
+                facts = [self.removed(var, val, self.top) for val in var.dom]
+            else:
+                facts = self.facts(reason, None, None, self.top)
+        else:
+            facts = list(facts)
+        if facts is None or None in facts:
+            return None
+        tvars = self.tvars
+        tvals = self.tvals
+        decisions = []
+        seen = set()
+        while facts:
+            i = facts.pop()
+            if i < root or i in seen:
+                continue
+            seen.add(i)
+            x = tvars[i]
+            if tvals[i] is ASSIGNED:
+                val = x.get_assigned_value()
+                implied = self.holds(x, val, i)
+                if implied is None:
+                    decisions.append((x, val))
+                else:
+                    facts.extend(implied)
+            else:
+                more = self.facts(self.treasons[i], x, tvals[i], i)
+                if more is None:
+                    return None
+                facts.extend(more)
+        return decisions
+
+
+class Nogood:
+    '''A set of assignments (var, val) that cannot all hold. lits[0]
+       and lits[1] are the literals watched by the NogoodDB'''
+
+    __slots__ = ("lits", "activity")
+
+    def __init__(self, lits):
+        self.lits = lits
+        self.activity = 0
+
+    def __str__(self):
+        return "Nogood({})".format(
+            ", ".join("{}={}".format(var.name, val) for var, val in self.lits))
+
+
+class NogoodDB:
+    '''Nogoods learned by BT, at most capacity of them.
+
+       A literal (var, val) is true when var is assigned val or val is
+       the only value left in its current domain, false once val is out
+       of the current domain. A nogood is only looked at when one of its
+       two watched literals becomes true: another literal that is not
+       true takes over the watch, or if there is none the nogood is
+       unit (prune the last value) or violated. Nothing is done on
+       backtracking, the watches stay valid.
+
+       Every time a nogood prunes or takes part in a conflict its
+       activity goes up. When the database is full the less active half
+       is dropped, except nogoods that are the reason of a pruning still
+       on the trail, and the activities of the rest are halved.'''
+
+    def __init__(self, capacity=2000):
+        self.capacity = capacity
+        self.nogoods = []
+        self.watches = dict()   #literal -> nogoods watching it
+        self.nLearned = 0
+        self.nPruned = 0
+
+    def __len__(self):
+        return len(self.nogoods)
+
+    def watch(self, ng):
+        for lit in ng.lits[:2]:
+            self.watches.setdefault(lit, []).append(ng)
+
+    def add(self, lits, trail):
+        '''learn the nogood lits (decisions still on the trail). The
+           latest decisions are watched, they are the first to be undone'''
+        lits.sort(key=lambda lit: trail.where[lit[0]][-1], reverse=True)
+        ng = Nogood(lits)
+        self.watch(ng)
+        self.nogoods.append(ng)
+        self.nLearned += 1
+        if len(self.nogoods) > self.capacity:
+            self.reduce(trail)
+        return ng
+
+    def reduce(self, trail):
+        '''drop the less active half of the nogoods'''
+        locked = set(trail.treasons[i] for i in range(trail.top))
+        ranked = sorted(self.nogoods, key=lambda ng: ng.activity, reverse=True)
+        keep = len(ranked) // 2
+        self.nogoods = [ng for i, ng in enumerate(ranked)
+                        if i < keep or ng in locked]
+        self.watches = dict()
+        for ng in self.nogoods:
+            ng.activity //= 2
+            self.watch(ng)
+
+    def propagate(self, trail, start):
+        '''Look at the trail entries from position start on (including
+           the prunings made here) for literals becoming true and update
+           the nogoods watching them. Return the variables pruned, or
+           None if a nogood is violated (trail.fail says which)'''
+        tvars = trail.tvars
+        watches = self.watches
+        pruned = []
+        i = start
+        while i < trail.top:
+            x = tvars[i]
+            i += 1
+            if x.cur_domain_size() != 1:
+                continue
+            lit = (x, x.cur_values()[0])
+            ws = watches.get(lit)
+            if not ws:
+                continue
+            j = 0
+            while j < len(ws):
+                ng = ws[j]
+                lits = ng.lits
+                if len(lits) == 1:
+                    ng.activity += 1
+                    trail.fail(ng)
+                    return None
+                if lits[0] == lit:
+                    lits[0], lits[1] = lits[1], lits[0]
+                var, val = lits[0]
+                if not var.in_cur_domain(val):
+                    #satisfied
+                    j += 1
+                    continue
+                for k in range(2, len(lits)):
+                    y, u = lits[k]
+                    if y.cur_domain_size() != 1 or not y.in_cur_domain(u):
+                        #not true, watch it instead
+                        lits[1], lits[k] = lits[k], lits[1]
+                        watches.setdefault(lits[1], []).append(ng)
+                        ws[j] = ws[-1]
+                        ws.pop()
+                        break
+                else:
+                    ng.activity += 1
+                    if var.cur_domain_size() == 1:
+                        trail.fail(ng)
+                        return None
+                    trail.prune(var, val, ng)
+                    self.nPruned += 1
+                    pruned.append(var)
+                    j += 1
+        return pruned
+
+
+class VarBuckets:
+    '''The unassigned variables of a search, bucketed by the key the
+       variable ordering heuristic minimises so picking a variable is
+       taking the first one from the lowest non-empty bucket.
+
+         MRV      key = current domain size
+         MCV      key = maxdeg - degree (most constraints first)
+         MRV+DEG  MRV, ties broken by MCV
+         other    key = 0, i.e. the order variables were added in
+
+       The degree of a variable is the number of constraints over it,
+       computed once. For the domain based keys the variables tell the
+       buckets when a prune/unprune changes their domain (see
+       Variable.selector), so the index stays current through search
+       and backtracking without rescans.
+
+       Ties go to the variable that entered the index first, as they did
+       in the old list of unassigned variables: the variables come in in
+       CSP order and one put back goes last, whatever its domain did
+       meanwhile. Each bucket is a heap of (entry, var), entry counting
+       the adds; the entries a variable leaves behind when it moves or
+       is removed are skipped when they come up, and the heaps are
+       rebuilt when stale entries make up most of them. Adding,
+       removing and moving a variable is O(log n).'''
+
+    def __init__(self, vars, heuristic):
+        self.heuristic = heuristic
+        self.by_size = heuristic in ("MRV", "MRV+DEG")
+        self.maxdeg = max([len(v.cons) for v in vars], default=0)
+        self.maxdom = max([v.domain_size() for v in vars], default=0)
+        self.degree = dict()
+        for v in vars:
+            self.degree[v] = len(v.cons)
+        if heuristic == "MRV":
+            nkeys = self.maxdom + 1
+        elif heuristic == "MCV":
+            nkeys = self.maxdeg + 1
+        elif heuristic == "MRV+DEG":
+            nkeys = (self.maxdom + 1) * (self.maxdeg + 1)
+        else:
+            nkeys = 1
+        self.buckets = [[] for i in range(nkeys)]
+        self.keys = dict()      #var -> its bucket, for vars in the index
+        self.entry = dict()     #var -> when it last entered the index
+        self.added = 0          #adds so far
+        self.size = 0           #heap entries, stale ones included
+        self.low = nkeys        #no bucket below this one is non-empty
+        for v in vars:
+            self.add(v)
+            if self.by_size:
+                v.selector = self
+
+    def __len__(self):
+        return len(self.keys)
+
+    def key(self, var):
+        '''bucket var belongs in given its current domain'''
+        if self.heuristic == "MRV":
+            return var.cur_domain_size()
+        if self.heuristic == "MCV":
+            return self.maxdeg - self.degree[var]
+        if self.heuristic == "MRV+DEG":
+            return (var.cur_domain_size() * (self.maxdeg + 1)
+                    + self.maxdeg - self.degree[var])
+        return 0
+
+    def push(self, var, k):
+        '''file var under bucket k'''
+        heapq.heappush(self.buckets[k], (self.entry[var], var))
+        self.keys[var] = k
+        if k < self.low:
+            self.low = k
+        self.size += 1
+        if self.size > 4 * len(self.entry) + 64:
+            self.rebuild()
+
+    def rebuild(self):
+        '''drop the stale heap entries'''
+        for bucket in self.buckets:
+            bucket.clear()
+        for var, k in self.keys.items():
+            self.buckets[k].append((self.entry[var], var))
+        for bucket in self.buckets:
+            heapq.heapify(bucket)
+        self.size = len(self.keys)
+
+    def add(self, var):
+        '''put var (back) into the index'''
+        self.entry[var] = self.added
+        self.added += 1
+        self.push(var, self.key(var))
+
+    def remove(self, var):
+        '''take var out of the index'''
+        del self.keys[var]
+
+    def moved(self, var):
+        '''var's current domain changed, move it to its new bucket'''
+        k = self.keys.get(var)
+        if k is not None:
+            newk = self.key(var)
+            if newk != k:
+                self.push(var, newk)
+
+    def pick(self):
+        '''remove and return the variable with the lowest key'''
+        buckets = self.buckets
+        keys = self.keys
+        entry = self.entry
+        k = self.low
+        while True:
+            bucket = buckets[k]
+            while bucket:
+                e, var = bucket[0]
+                if keys.get(var) == k and entry[var] == e:
+                    heapq.heappop(bucket)
+                    self.size -= 1
+                    del keys[var]
+                    self.low = k
+                    return var
+                heapq.heappop(bucket)
+                self.size -= 1
+            k += 1
+
+    def detach(self):
+        '''stop listening to the variables' domain changes'''
+        if self.by_size:
+            for v in self.degree:
+                v.selector = None
+
+
+class WdegHeap:
+    '''The unassigned variables of a search for the dom/wdeg heuristic:
+       pick the one with the smallest current domain size / weighted
+       degree, ties to the variable added to the CSP first.
+
+       The weighted degree of var is the sum of the weights (see
+       Constraint.weight) of its constraints that have another variable
+       still in the index. It is kept up to date as variables leave and
+       come back (a constraint left with one variable in the index
+       stops counting for it), as domains change (Variable.selector)
+       and as weights are bumped (bumped), and each change pushes a new
+       heap entry for the variable. The entries it replaces are not
+       removed but skipped when they come up: an entry is current only
+       if its version is the variable's last one. The heap is rebuilt
+       when stale entries make up most of it.'''
+
+    def __init__(self, vars):
+        self.rank = dict()      #var -> tie break, its position
+        self.wdeg = dict()      #var -> weighted degree, for vars in the index
+        self.version = dict()   #var -> version of its current heap entry
+        self.future = dict()    #constraint -> its variables in the index
+        self.heap = []
+        self.vars = vars
+        for i, v in enumerate(vars):
+            self.rank[v] = i
+            self.version[v] = 0
+            v.selector = self
+            for c in v.cons:
+                self.future[c] = self.future.get(c, 0) + 1
+        for v in vars:
+            self.wdeg[v] = self.weighted_degree(v)
+            self.push(v)
+
+    def __len__(self):
+        return len(self.wdeg)
+
+    def weighted_degree(self, var):
+        future = self.future
+        return sum(c.weight for c in var.cons if future[c] > 1)
+
+    def push(self, var):
+        '''(re)enter var in the heap with its current ratio'''
+        self.version[var] += 1
+        wdeg = self.wdeg[var]
+        ratio = var.cur_domain_size() / wdeg if wdeg else math.inf
+        heapq.heappush(self.heap, (ratio, self.rank[var], self.version[var],
+                                   var))
+        if len(self.heap) > 4 * len(self.rank) + 64:
+            self.heap = [e for e in self.heap
+                         if e[3] in self.wdeg and e[2] == self.version[e[3]]]
+            heapq.heapify(self.heap)
+
+    def last_in(self, c):
+        '''the one variable of c still in the index'''
+        for y in c.scope:
+            if y in self.wdeg:
+                return y
+
+    def add(self, var):
+        '''put var (back) into the index'''
+        for c in var.cons:
+            n = self.future[c] = self.future[c] + 1
+            if n == 2:
+                #c counts again for the variable that was alone in it
+                y = self.last_in(c)
+                self.wdeg[y] += c.weight
+                self.push(y)
+        self.wdeg[var] = self.weighted_degree(var)
+        self.push(var)
+
+    def remove(self, var):
+        '''take var out of the index'''
+        del self.wdeg[var]
+        for c in var.cons:
+            n = self.future[c] = self.future[c] - 1
+            if n == 1:
+                y = self.last_in(c)
+                self.wdeg[y] -= c.weight
+                self.push(y)
+
+    def moved(self, var):
+        '''var's current domain changed'''
+        if var in self.wdeg:
+            self.push(var)
+
+    def bumped(self, c):
+        '''c's weight went up by one'''
+        if self.future.get(c, 0) > 1:
+            for y in c.scope:
+                if y in self.wdeg:
+                    self.wdeg[y] += 1
+                    self.push(y)
+
+    def pick(self):
+        '''remove and return the variable with the lowest ratio'''
+        heap = self.heap
+        while True:
+            ratio, rank, version, var = heapq.heappop(heap)
+            if var in self.wdeg and version == self.version[var]:
+                self.remove(var)
+                return var
+
+    def detach(self):
+        '''stop listening to the variables' domain changes'''
+        for v in self.vars:
+            v.selector = None
+
+
+class ConBuckets:
+    '''Constraints bucketed by their number of unassigned variables,
+       the index behind the MAV heuristic. Assigning or unassigning a
+       variable moves the constraints over it to their new bucket (see
+       Variable.con_buckets), so finding a constraint with the fewest
+       unassigned variables is a look at the lowest non-empty bucket
+       above 0 rather than a pass over every constraint.
+
+       Each bucket is a dict from its constraints to their positions in
+       the CSP, so a move is O(1) and ties go to the constraint added to
+       the CSP first, as they did with the old scan over get_all_cons.
+
+       types restricts the index to constraints of those types, e.g.
+       "o" to only consider rows, columns and parks.'''
+
+    def __init__(self, cons, types=None):
+        if types is not None:
+            cons = [c for c in cons if c.get_type() in types]
+        self.cons = list(cons)
+        self.buckets = [dict() for i in range(
+            max([len(c.scope) for c in cons], default=0) + 1)]
+        self.keys = dict()      #constraint -> its bucket
+        self.low = len(self.buckets)
+        self.vars = []
+        for i, c in enumerate(self.cons):
+            k = c.get_n_unasgn()
+            self.buckets[k][c] = i
+            self.keys[c] = k
+            if 0 < k < self.low:
+                self.low = k
+            for v in c.scope:
+                if v.con_buckets is not self:
+                    v.con_buckets = self
+                    self.vars.append(v)
+
+    def moved(self, var):
+        '''var was assigned or unassigned, rebucket its constraints'''
+        keys = self.keys
+        buckets = self.buckets
+        for c in var.cons:
+            k = keys.get(c)
+            if k is not None:
+                newk = len(c.scope) - c.n_asgn
+                buckets[newk][c] = buckets[k].pop(c)
+                keys[c] = newk
+                if 0 < newk < self.low:
+                    self.low = newk
+
+    def pick(self):
+        '''return a constraint with the fewest (but some) unassigned
+           variables, None if every constraint is fully assigned'''
+        buckets = self.buckets
+        k = self.low
+        while k < len(buckets) and not buckets[k]:
+            k += 1
+        self.low = k
+        if k == len(buckets):
+            return None
+        bucket = buckets[k]
+        return min(bucket, key=bucket.__getitem__)
+
+    def detach(self):
+        '''stop listening to the variables\' assignments'''
+        for v in self.vars:
+            v.con_buckets = None
+
+
+class SearchStopped(Exception):
+    '''Raised inside the search when a Budget runs out, caught by
+       bt_search. reason is the limit reached'''
+
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+
+class CancelToken:
+    '''Asks a running search to stop (see Budget). cancel() may be
+       called from another thread, or from another process if the token
+       was handed to it when it was started (multiprocessing.Process
+       args), not through a queue'''
+
+    def __init__(self):
+        self.event = multiprocessing.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def cancelled(self):
+        return self.event.is_set()
+
+
+def memory_used():
+    '''Bytes of memory the process is using: its resident set where
+       /proc tells it, otherwise the peak of it'''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Budget:
+    '''Limits on one bt_search: wall clock seconds, decisions
+       (nDecisions), prunings (nPrunings), memory in bytes (see
+       memory_used) and a CancelToken. None is no limit.
+
+       The search ticks the budget once per node and the GAC style
+       propagators once per constraint they revise (RevisionQueue.pop);
+       every check_every ticks the limits are checked and the first one
+       reached stops the search with SearchStopped. bt_search then
+       returns None, unknown, instead of True or False'''
+
+    def __init__(self, time=None, decisions=None, prunings=None,
+                 memory=None, cancel=None, check_every=64):
+        self.time = time
+        self.decisions = decisions
+        self.prunings = prunings
+        self.memory = memory
+        self.cancel = cancel
+        self.check_every = check_every
+        self.bt = None
+        self.ticks = 0
+        self.deadline = None
+
+    def start(self, bt):
+        '''Start counting for a search of bt'''
+        self.bt = bt
+        self.ticks = 0
+        self.deadline = None
+        if self.time is not None:
+            self.deadline = time.perf_counter() + self.time
+        self.check()
+
+    def tick(self):
+        self.ticks += 1
+        if self.ticks % self.check_every == 0:
+            self.check()
+
+    def check(self):
+        '''Raise SearchStopped if a limit is reached'''
+        if self.cancel is not None and self.cancel.cancelled():
+            raise SearchStopped("cancel")
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchStopped("time")
+        bt = self.bt
+        if self.decisions is not None and bt.nDecisions >= self.decisions:
+            raise SearchStopped("decisions")
+        if self.prunings is not None and bt.trail.nPruned >= self.prunings:
+            raise SearchStopped("prunings")
+        if self.memory is not None and memory_used() >= self.memory:
+            raise SearchStopped("memory")
+
+
+def trees_and_candidates(vars, var):
+    '''Among vars other than var: how many are trees (1 is all that is
+       left, or assigned 1) and the list of candidates (0 and 1 left)'''
+    trees = 0
+    candidates = []
+    for y in vars:
+        if y is not var and y.in_cur_domain(1):
+            if y.in_cur_domain(0):
+                candidates.append(y)
+            else:
+                trees += 1
+    return trees, candidates
+
+
+def lcv_cost(var, val):
+    '''Least constraining value: the number of values var = val takes
+       at once from other variables, counted on the constraint index
+       var.cons. A tree takes 1 from its candidate neighbours and, when
+       it completes a row, column or park, from the candidates left
+       there; a 0 leaving a row/column/park just enough candidates
+       makes them trees, taking 0 from them. A value that leaves a
+       constraint unsatisfiable costs inf'''
+    lost = set()
+    for c in var.cons:
+        kind = c.get_type()
+        if kind == 'o':
+            trees, candidates = trees_and_candidates(c.scope, var)
+            need = c.numtree - trees - (val == 1)
+            if need < 0 or need > len(candidates):
+                return math.inf
+            if need == 0:
+                lost.update((y, 1) for y in candidates)
+            elif need == len(candidates):
+                lost.update((y, 0) for y in candidates)
+        elif val == 1:
+            others = c.neighbours[var] if kind == 't' else c.scope
+            trees, candidates = trees_and_candidates(others, var)
+            if trees:
+                return math.inf
+            lost.update((y, 1) for y in candidates)
+    return len(lost)
+
+
+def slack_cost(var, val):
+    '''Most slack first: minus the number of ways the rows, columns and
+       parks of var can still get their trees with var = val, the
+       product over them of C(candidates, trees still needed). The value
+       keeping the most completions goes first, 0 ways comes last'''
+    ways = 1
+    for c in var.cons:
+        if c.get_type() == 'o':
+            trees, candidates = trees_and_candidates(c.scope, var)
+            need = c.numtree - trees - (val == 1)
+            if need < 0 or need > len(candidates):
+                return 0
+            ways *= math.comb(len(candidates), need)
+    return -ways
+
+
+# value orders of BT (BT.value_order), name -> (cost, shuffle): values
+# are tried by increasing cost(var, val), ties in the order of the
+# domain (set by the models' priority) or, if shuffle, a random one
+value_orders = {
+    "static": (None, False),
+    "LCV": (lcv_cost, False),
+    "LCV+R": (lcv_cost, True),
+    "slack": (slack_cost, False),
+    "slack+R": (slack_cost, True),
+    "random": (None, True),
+}
+
+
+# the bt_search options of each search, e.g. for AlberiSolver
+search_modes = {
+    "BT": {},
+    "iterative": {"iterative": True},
+    "CBJ": {"backjumping": True},
+    "learning": {"learning": True},
+    "CBJ+learning": {"backjumping": True, "learning": True},
+}
+
+
 class BT:
     '''use a class to encapsulate things like statistics
        and bookeeping for pruning/unpruning variabel domains
@@ -412,17 +1664,42 @@ class BT:
        kind or propagator function to obtain plain backtracking
        forward-checking or gac'''
 
-    def __init__(self, csp, heuristic):
-        '''csp == CSP object specifying the CSP to be solved'''
+    def __init__(self, csp, heuristic, value_order="static"):
+        '''csp == CSP object specifying the CSP to be solved
+           value_order == a key of value_orders, the order the values of
+           each variable are tried in. It can be changed between
+           searches, like heuristic, without building the model again'''
 
         self.csp = csp
         self.heuristic = heuristic
+        self.value_order = value_order
+        self.seed = 0           #of the random value orders, each search
+        self.rng = random.Random(self.seed)
         self.nDecisions = 0 #nDecisions is the number of variable 
                             #assignments made during search
         self.nPrunings  = 0 #nPrunings is the number of value prunings during search
         unasgn_vars = list() #used to track unassigned variables
+        self.con_buckets = None #constraint index used by MAV
+        self.wdeg = None        #the WdegHeap while searching with dom/wdeg
+        self.nogoods = None     #NogoodDB while searching with learning
+        self.max_nogoods = 2000 #size of that database
+        self.root = 0           #trail size after the root propagation
+        self.conflict = None    #decisions behind the last deadend
+        self.path = []          #assigned variables, for bt_backjump
+        self.assumptions = []   #assigned before the search, see bt_search
+        #asked by bt_iterate whether to give work away, see give_away
+        self.sharer = None
+        self.counting = False   #bt_search(count=True): go on after solutions
+        self.limit = None       #stop counting at this many solutions
+        self.solutions = []     #the solutions counted, values of csp.vars
+        self.budget = None      #Budget of the running search, if any
+        self.stopped = None     #limit that stopped the last search
         self.TRACE = False
         self.runtime = 0
+        self.search_ns = 0
+        #room for every value of every variable to be pruned plus every
+        #variable to be assigned, the most one search path can record
+        self.trail = Trail(sum(v.domain_size() + 1 for v in csp.vars))
 
     def trace_on(self):
         '''Turn search trace on'''
@@ -437,11 +1714,16 @@ class BT:
         '''Initialize counters'''
         self.nDecisions = 0
         self.nPrunings = 0
-        self.runtime = 0
+        self.runtime = 0        #CPU seconds of the last bt_search
+        self.search_ns = 0      #wall clock nanoseconds of the same
+        self.nSolutions = 0
 
     def print_stats(self):
         print("Search made {} variable assignments and pruned {} variable values".format(
             self.nDecisions, self.nPrunings))
+        if self.nogoods is not None:
+            print("Learned {} nogoods ({} kept), they pruned {} values".format(
+                self.nogoods.nLearned, len(self.nogoods), self.nogoods.nPruned))
 
     def restoreValues(self,prunings):
         '''Restore list of values to variable domains
@@ -457,58 +1739,44 @@ class BT:
             var.restore_curdom()
 
     def pick_var(self):
-        '''Remove variable with minimum sized cur domain from list of
-           unassigned vars. Would be faster to use heap...but this is
-           not production code.
+        '''Remove variable chosen by the heuristic from the unassigned
+           vars and return it. MRV, MCV, MRV+DEG and the default (first
+           variable) are a lookup in the VarBuckets index, dom/wdeg in
+           the WdegHeap; MAV (MAV-O:
+           only row/column/park constraints) takes the first unassigned
+           variable of the constraint with the fewest unassigned
+           variables, found in the ConBuckets index.
         '''
-        if self.heuristic == "MRV":
-            md = -1
-            mv = None
-            for v in self.unasgn_vars:
-                if md < 0:
-                    md = v.cur_domain_size()
-                    mv = v
-                elif v.cur_domain_size() < md:
-                    md = v.cur_domain_size()
-                    mv = v
-            self.unasgn_vars.remove(mv)
-            return mv
-        if self.heuristic == "MCV":
-            mc = -1
-            mv = None
-            for v in self.unasgn_vars:
-                cons_var = self.csp.get_cons_with_var(v)
-                if mc < 0:
-                    mc = len(cons_var)
-                    mv = v
-                elif len(cons_var) > mc:
-                    mc = len(cons_var)
-                    mv = v
-            self.unasgn_vars.remove(mv)
-            return mv
-        if self.heuristic == "MAV":
-            mn = 10000000000
-            mc = None
-            for c in self.csp.get_all_cons():
-                num_unasgn = c.get_n_unasgn()
-                if num_unasgn > 0 and num_unasgn < mn:
-                    mn = num_unasgn
-                    mc = c
-            mv = None
+        if self.con_buckets is not None:
+            mc = self.con_buckets.pick()
             if mc is not None:
-                mv = mc.get_unasgn_vars()[0]
-                self.unasgn_vars.remove(mv)
-            return mv
-        else:
-            mv = self.unasgn_vars[0]
-            self.unasgn_vars.remove(mv)
-            return mv
+                for mv in mc.scope:
+                    if not mv.is_assigned():
+                        self.unasgn_vars.remove(mv)
+                        return mv
+        return self.unasgn_vars.pick()
+
+    def order_values(self, var):
+        '''The current values of var in the order to try them, see
+           value_orders'''
+        vals = var.cur_values()
+        cost, shuffle = self.ordering
+        if len(vals) < 2 or (cost is None and not shuffle):
+            return vals
+        vals = list(vals)
+        if shuffle:
+            self.rng.shuffle(vals)
+        if cost is not None:
+            vals.sort(key=lambda val: cost(var, val))
+        return vals
 
     def restoreUnasgnVar(self, var):
-        '''Add variable back to list of unassigned vars'''
-        self.unasgn_vars.append(var)
+        '''Add variable back to the unassigned vars'''
+        self.unasgn_vars.add(var)
         
-    def bt_search(self,propagator):
+    def bt_search(self,propagator,iterative=False,learning=False,
+                  backjumping=False,assumptions=(),count=False,limit=None,
+                  budget=None):
         '''Try to solve the CSP using specified propagator routine
 
            propagator == a function with the following template
@@ -538,43 +1806,239 @@ class BT:
            values when it undoes a variable assignment.
 
            NOTE propagator SHOULD NOT prune a value that has already been 
-           pruned! Nor should it prune a value twice'''
+           pruned! Nor should it prune a value twice
+
+           Rather than building that list a propagator can prune through
+           csp.pruner(). While bt_search runs that is the search Trail,
+           which records each pruning itself, and the propagator returns
+           the trail in place of the list. A returned list is copied onto
+           the trail, so propagators written the old way still work.
+
+           iterative == True runs the search with bt_iterate, which keeps
+           its choice points on an explicit stack instead of recursing
+           once per variable (bt_recurse cannot go deeper than Python's
+           recursion limit, about 1000 variables). Both make the same
+           decisions and report the same statistics.
+
+           Returns True if a solution was found (it is left assigned to
+           the variables) and False if there is none.
+
+           learning == True turns on nogood learning: each deadend is
+           traced back through the reasons of the prunings behind it to
+           the decisions that caused it, and that set of assignments is
+           kept as a nogood (see NogoodDB) that prunes the rest of the
+           search. It needs propagators that give prune a reason and
+           call fail (all of propagators.py do); a deadend without a
+           reason is simply not learned from.
+
+           backjumping == True searches with bt_backjump, conflict
+           directed backjumping over the same reasons. It replaces the
+           iterative search and can be combined with learning.
+
+           assumptions == (Variable, value) pairs assigned and propagated
+           before the search starts, e.g. the partial assignment of one
+           subproblem of a parallel search (see parallel.py). They are
+           part of the root, the search never undoes them.
+
+           count == True counts solutions: the search goes on after each
+           one, until there are no more or limit of them are found (so
+           limit=2 tells whether the solution is unique). self.solutions
+           lists them, self.nSolutions counts them. The statistics are
+           those of the same search going on. It works with every search
+           engine: with learning each solution becomes a nogood, with
+           backjumping it is a conflict of all the decisions. Returns
+           True if there is a solution. The last one found is left
+           assigned only if the search stopped at limit.
+
+           budget == a Budget limiting time, decisions, prunings and
+           memory, which may also be cancelled. When it stops the search
+           bt_search returns None, unknown, with self.stopped the limit
+           reached ("time", "decisions", "prunings", "memory" or
+           "cancel") and the statistics of the search so far. A count
+           stopped so is a lower bound.'''
 
         self.clear_stats()
+        self.counting = count
+        self.limit = limit
+        self.solutions = []
+        self.stopped = None
+        self.ordering = value_orders[self.value_order]
+        self.rng.seed(self.seed)
         stime = time.process_time()
+        start_ns = time.perf_counter_ns()
 
         self.restore_all_variable_domains()
-        
-        self.unasgn_vars = []
-        for v in self.csp.vars:
-            if not v.is_assigned():
-                self.unasgn_vars.append(v)
-
-        status, prunings = propagator(self.csp) #initial propagate no assigned variables.
-        self.nPrunings = self.nPrunings + len(prunings)
-
-        if self.TRACE:
-            print(len(self.unasgn_vars), " unassigned variables at start of search")
-            print("Root Prunings: ", prunings)
-
-
-        if status == False:
-            print("CSP{} detected contradiction at root".format(
-                self.csp.name))
-        else:
-            status = self.bt_recurse(propagator, 1)   #now do recursive search
-
+        reasons = learning or backjumping
+        if reasons != isinstance(self.trail, ReasonTrail):
+            kind = ReasonTrail if reasons else Trail
+            self.trail = kind(len(self.trail.tvars))
+        self.nogoods = NogoodDB(self.max_nogoods) if learning else None
+        self.trail.clear()
+        self.csp.trail = self.trail
+        self.unasgn_vars = None
+        self.con_buckets = None
+
+        try:
+            status = True
+            self.assumptions = list(assumptions)
+            for var, val in self.assumptions:
+                if var.is_assigned() or not var.in_cur_domain(val):
+                    status = False
+                    break
+                self.trail.assign(var, val)
+                if not self.propagate(propagator, var):
+                    status = False
+                    break
+
+            unasgn_vars = [v for v in self.csp.vars if not v.is_assigned()]
+            if self.heuristic == "dom/wdeg":
+                self.unasgn_vars = self.wdeg = WdegHeap(unasgn_vars)
+            else:
+                self.unasgn_vars = VarBuckets(unasgn_vars, self.heuristic)
+            if self.heuristic == "MAV":
+                self.con_buckets = ConBuckets(self.csp.cons)
+            elif self.heuristic == "MAV-O":
+                self.con_buckets = ConBuckets(self.csp.cons, "o")
+
+            self.budget = budget
+            self.csp.queue.budget = budget
+            if budget is not None:
+                budget.start(self)
+            #initial propagate, no assigned variables but the assumptions
+            status = status and self.propagate(propagator, None)
+            self.root = self.trail.top
 
-        self.restoreValues(prunings)
-        if status == False:
+            if self.TRACE:
+                print(len(self.unasgn_vars), " unassigned variables at start of search")
+                print("Root Prunings: ", self.trail.since(0))
+
+
+            if status == False:
+                print("CSP{} detected contradiction at root".format(
+                    self.csp.name))
+            elif backjumping:
+                self.path = []
+                status = self.bt_backjump(propagator, 1) is True
+            elif iterative:
+                status = self.bt_iterate(propagator)      #now do iterative search
+            else:
+                status = self.bt_recurse(propagator, 1)   #now do recursive search
+        except SearchStopped as stop:
+            #stopped anywhere, maybe inside a propagator
+            self.stopped = stop.reason
+            self.csp.queue.clear()
+            self.nPrunings = self.trail.nPruned
+            status = None
+        finally:
+            #search time without the printing below
+            self.runtime = time.process_time() - stime
+            self.search_ns = time.perf_counter_ns() - start_ns
+            #unhook the search from the CSP even if something raised, so
+            #no stale trail or index is left on it
+            self.budget = None
+            self.csp.queue.budget = None
+            self.csp.trail = None
+            if self.unasgn_vars is not None:
+                self.unasgn_vars.detach()
+            self.wdeg = None
+            if self.con_buckets is not None:
+                self.con_buckets.detach()
+        if status is None:
+            self.trail.undo(0)
+            print("CSP{} unknown, stopped by the {} limit{}. CPU Time used = {}".format(
+                self.csp.name, self.stopped,
+                " after {} solutions".format(self.nSolutions) if count else "",
+                self.runtime))
+        elif count:
+            #the engines return True only when stopped at the limit
+            stopped = status
+            status = self.nSolutions > 0
+            if not stopped:
+                self.trail.undo(0)
+            print("CSP{} has {}{} solutions. CPU Time used = {}".format(
+                self.csp.name, "at least " if stopped else "",
+                self.nSolutions, self.runtime))
+        elif status == False:
+            self.trail.undo(0)
             print("CSP{} unsolved. Has no solutions".format(self.csp.name))
-        if status == True:
+        elif status == True:
             print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
-                                                             time.process_time() - stime))
+                                                             self.runtime))
             self.csp.print_soln()
 
         print("bt_search finished")
         self.print_stats()
+        return status
+
+    def count_solutions(self, propagator, limit=None, **search_args):
+        '''bt_search counting solutions (up to limit), return how many.
+           search_args are bt_search's, e.g. search_modes["CBJ"]'''
+        self.bt_search(propagator, count=True, limit=limit, **search_args)
+        return self.nSolutions
+
+    def found(self):
+        '''All variables are assigned. Return True if the search should
+           stop there, False to go on counting. The solution is then
+           blocked: the decisions leading to it (the assignments starting
+           each level) become a nogood when learning'''
+        self.nSolutions += 1
+        if not self.counting:
+            return True
+        self.solutions.append([v.get_assigned_value() for v in self.csp.vars])
+        if self.limit is not None and self.nSolutions >= self.limit:
+            return True
+        if self.nogoods is not None and self.trail.levels:
+            tvars = self.trail.tvars
+            self.nogoods.add([(tvars[p], tvars[p].get_assigned_value())
+                              for p in self.trail.levels], self.trail)
+        return False
+
+    def propagate(self, propagator, var):
+        '''Run propagator after var is assigned (None: at the root) and
+           return its status. Each call ticks the search budget, and a
+           deadend bumps the weight of the constraint that caused it (the
+           reason the propagator gave fail), which dom/wdeg uses. With
+           learning the nogoods are run too, alternating with propagator
+           on the variables they prune until neither prunes more. With
+           learning or backjumping a deadend below the root is analysed,
+           self.conflict is the list of decisions behind it (None if it
+           has no known reason) and with learning that list becomes a
+           nogood'''
+        if self.budget is not None:
+            self.budget.tick()
+        trail = self.trail
+        trail.failed = None
+        nogoods = self.nogoods
+        if nogoods is not None:
+            trail.conflict = None
+            start = trail.levels[-1] if trail.levels else 0
+        status, prunings = propagator(self.csp, var)
+        if prunings is not trail:
+            trail.record(prunings)
+        if nogoods is not None:
+            while status:
+                pruned = nogoods.propagate(trail, start)
+                start = trail.top
+                if pruned is None:
+                    status = False
+                for v in pruned or ():
+                    status, prunings = propagator(self.csp, v)
+                    if prunings is not trail:
+                        trail.record(prunings)
+                    if not status:
+                        break
+                if not pruned:
+                    break
+        if not status and isinstance(trail.failed, Constraint):
+            trail.failed.weight += 1
+            if self.wdeg is not None:
+                self.wdeg.bumped(trail.failed)
+        if not status and trail.levels and isinstance(trail, ReasonTrail):
+            self.conflict = trail.analyse(self.root)
+            if nogoods is not None and self.conflict:
+                nogoods.add(self.conflict, trail)
+        self.nPrunings = trail.nPruned
+        return status
 
     def bt_recurse(self, propagator, level):
         '''Return true if found solution. False if still need to search.
@@ -585,36 +2049,186 @@ class BT:
            
         if not self.unasgn_vars:
             #all variables assigned
-            return True
+            return self.found()
         else:
             var = self.pick_var()
             if self.TRACE:
                 print('  ' * level, "bt_recurse var = ", var)
 
-            for val in var.cur_domain():
+            trail = self.trail
+            for val in self.order_values(var):
 
                 if self.TRACE:
                     print('  ' * level, "bt_recurse trying", var, "=", val)
 
-                var.assign(val)
+                trail.push_level()
+                trail.assign(var, val)
                 self.nDecisions = self.nDecisions+1
 
-                status, prunings = propagator(self.csp, var)
-                self.nPrunings = self.nPrunings + len(prunings)
+                status = self.propagate(propagator, var)
 
                 if self.TRACE:
                     print('  ' * level, "bt_recurse prop status = ", status)
-                    print('  ' * level, "bt_recurse prop pruned = ", prunings)
+                    print('  ' * level, "bt_recurse prop pruned = ",
+                          trail.since(trail.levels[-1]))
 
                 if status:
                     if self.bt_recurse(propagator, level+1):
                         return True
 
                 if self.TRACE:
-                    print('  ' * level, "bt_recurse restoring ", prunings)
-                self.restoreValues(prunings)
-                var.unassign()
+                    print('  ' * level, "bt_recurse restoring ",
+                          trail.since(trail.levels[-1]))
+                trail.pop_level()
 
             self.restoreUnasgnVar(var)
             return False
 
+    def bt_backjump(self, propagator, level):
+        '''Conflict directed backjumping. Return True if found
+           solution, else the conflict set of the subtree: the variables
+           whose assignments (all above this level) made it fail.
+
+           The conflict set of var collects, for each of its values, the
+           decisions behind the deadend (self.conflict, traced back
+           through the pruning reasons) or the conflict set returned by
+           the subtree, and the decisions that pruned the values var
+           never got to try. If var is not in the conflict set of one of
+           its values that value was not the problem: every other value
+           fails the same way, so the search jumps straight back to the
+           deepest variable of that set instead of trying them. Without
+           known reasons the set is every assigned variable, which is
+           chronological backtracking'''
+
+        if self.TRACE:
+            print('  ' * level, "bt_backjump level ", level)
+
+        if not self.unasgn_vars:
+            #all variables assigned. If counting, go back as from a
+            #conflict of every decision: chronologically
+            return True if self.found() else set(self.path)
+        var = self.pick_var()
+        if self.TRACE:
+            print('  ' * level, "bt_backjump var = ", var)
+
+        trail = self.trail
+        pruned = [trail.removed(var, val, trail.top) for val in var.dom
+                  if not var.in_cur_domain(val)]
+        conflict = set()
+        for val in self.order_values(var):
+
+            if self.TRACE:
+                print('  ' * level, "bt_backjump trying", var, "=", val)
+
+            trail.push_level()
+            trail.assign(var, val)
+            self.path.append(var)
+            self.nDecisions = self.nDecisions+1
+
+            if self.propagate(propagator, var):
+                culprits = self.bt_backjump(propagator, level+1)
+                if culprits is True:
+                    return True
+            elif self.conflict is None:
+                culprits = set(self.path)
+            else:
+                culprits = set(v for v, _ in self.conflict)
+
+            self.path.pop()
+            trail.pop_level()
+            if var not in culprits:
+                if self.TRACE:
+                    print('  ' * level, "bt_backjump jumping over", var)
+                self.restoreUnasgnVar(var)
+                return culprits
+            conflict |= culprits
+
+        decisions = trail.analyse(self.root, pruned)
+        if decisions is None:
+            conflict.update(self.path)
+        else:
+            conflict.update(v for v, _ in decisions)
+        conflict.discard(var)
+        self.restoreUnasgnVar(var)
+        return conflict
+
+    def give_away(self, stack_vars, stack_vals, stack_next):
+        '''Give the untried values of the shallowest choice point that
+           has any to self.sharer.give, as subproblems: lists of the
+           assumptions, the assignments above that choice point and
+           var = value. The choice point then ends after the values it
+           has tried, so what is given away plus what is left here is the
+           search space bt_iterate had before'''
+        for j in range(len(stack_vars)):
+            if stack_next[j] < len(stack_vals[j]):
+                prefix = self.assumptions + [
+                    (v, v.get_assigned_value()) for v in stack_vars[:j]]
+                var = stack_vars[j]
+                self.sharer.give([prefix + [(var, val)]
+                                  for val in stack_vals[j][stack_next[j]:]])
+                stack_vals[j] = stack_vals[j][:stack_next[j]]
+                return
+
+    def bt_iterate(self, propagator):
+        '''Same search as bt_recurse without recursion. The choice
+           points (variable, its values, index of the next value to try)
+           of the current path are kept on three parallel stacks; moving
+           down pushes one, running out of values pops it and undoes the
+           parent's assignment. Return true if found solution'''
+
+        if not self.unasgn_vars:
+            return self.found()
+        trail = self.trail
+        stack_vars = []
+        stack_vals = []
+        stack_next = []
+        var = self.pick_var()
+        vals = self.order_values(var)
+        i = 0
+        while True:
+            if i < len(vals):
+                val = vals[i]
+                i += 1
+                if self.TRACE:
+                    print('  ' * (len(stack_vars) + 1), "bt_iterate trying", var, "=", val)
+
+                trail.push_level()
+                trail.assign(var, val)
+                self.nDecisions = self.nDecisions+1
+
+                status = self.propagate(propagator, var)
+
+                if self.TRACE:
+                    print('  ' * (len(stack_vars) + 1), "bt_iterate prop status = ", status)
+                    print('  ' * (len(stack_vars) + 1), "bt_iterate prop pruned = ",
+                          trail.since(trail.levels[-1]))
+
+                if status and not self.unasgn_vars:
+                    #all variables assigned
+                    if self.found():
+                        return True
+                    status = False
+                if status:
+                    #go down: remember where we are and pick the next var
+                    stack_vars.append(var)
+                    stack_vals.append(vals)
+                    stack_next.append(i)
+                    if self.sharer is not None and self.sharer.hungry():
+                        self.give_away(stack_vars, stack_vals, stack_next)
+                    var = self.pick_var()
+                    vals = self.order_values(var)
+                    i = 0
+                else:
+                    trail.pop_level()
+            else:
+                #values of var exhausted: go back up to its parent
+                self.restoreUnasgnVar(var)
+                if not stack_vars:
+                    return False
+                var = stack_vars.pop()
+                vals = stack_vals.pop()
+                i = stack_next.pop()
+                if self.TRACE:
+                    print('  ' * (len(stack_vars) + 1), "bt_iterate restoring ",
+                          trail.since(trail.levels[-1]))
+                trail.pop_level()
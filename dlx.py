@@ -0,0 +1,180 @@
+import time
+
+"""
+Dancing Links (Knuth's Algorithm X) engine for one tree puzzles.
+
+With numtree == 1 every row, column and park holds exactly one tree, so a
+solution is an exact cover: each cell is a matrix row that covers its
+board row, its board column and its park (the primary columns). Two
+trees touch only if they are in the same row, the same column, or
+diagonal neighbours, and a diagonal pair always shares one of the 2x2
+windows of alberi_model_1. So the windows become secondary columns that
+may be covered at most once.
+
+The matrix is kept in flat lists (L, R, U, D, C indexed by node number,
+node 0 the root, then the column headers, then the cell nodes) rather
+than node objects, so covering and uncovering are list index updates.
+"""
+
+
+class DLX:
+    """
+    Build the exact cover matrix for board (same format as the board
+    given to alberi_model_1). dlx_search() mirrors BT.bt_search: it
+    keeps nDecisions (cells given a tree), nPrunings (cells removed from
+    the matrix by covering a column) and runtime, and prints the same
+    kind of messages.
+    """
+
+    def __init__(self, board, numtree=1, name=""):
+        self.board = board
+        self.numtree = numtree
+        self.name = name
+        self.dim = n = len(board)
+        parks = dict()
+        for r in range(n):
+            for c in range(n):
+                parks.setdefault(board[r][c], len(parks))
+        self.nPrimary = nPrimary = 2 * n + len(parks)
+        nWindows = (n - 1) * (n - 1)
+        ncols = nPrimary + nWindows
+        # headers 1..nPrimary are linked to the root, the window headers
+        # are left linked to themselves so they are never chosen
+        L = self.L = [nPrimary] + list(range(nPrimary)) + list(range(nPrimary + 1, ncols + 1))
+        R = self.R = list(range(1, nPrimary + 1)) + [0] + list(range(nPrimary + 1, ncols + 1))
+        U = self.U = list(range(ncols + 1))
+        D = self.D = list(range(ncols + 1))
+        C = self.C = list(range(ncols + 1))
+        self.S = [0] * (ncols + 1)
+        self.cell_of = [None] * (ncols + 1)
+        for r in range(n):
+            for c in range(n):
+                cols = [1 + r, 1 + n + c, 1 + 2 * n + parks[board[r][c]]]
+                for i in range(max(r - 1, 0), min(r + 1, n - 1)):
+                    for j in range(max(c - 1, 0), min(c + 1, n - 1)):
+                        cols.append(1 + nPrimary + i * (n - 1) + j)
+                first = len(L)
+                for k, col in enumerate(cols):
+                    node = first + k
+                    L.append(node - 1 if k else first + len(cols) - 1)
+                    R.append(node + 1 if k < len(cols) - 1 else first)
+                    U.append(U[col])
+                    D.append(col)
+                    C.append(col)
+                    D[U[col]] = node
+                    U[col] = node
+                    self.S[col] += 1
+                    self.cell_of.append((r, c))
+        self.solution = None
+        self.clear_stats()
+
+    def clear_stats(self):
+        '''Initialize counters'''
+        self.nDecisions = 0
+        self.nPrunings = 0
+        self.runtime = 0
+
+    def print_stats(self):
+        print("Search made {} variable assignments and pruned {} variable values".format(
+            self.nDecisions, self.nPrunings))
+
+    def cover(self, col):
+        '''Take col out of the header list and its rows out of the matrix'''
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        R[L[col]] = R[col]
+        L[R[col]] = L[col]
+        i = D[col]
+        while i != col:
+            j = R[i]
+            while j != i:
+                U[D[j]] = U[j]
+                D[U[j]] = D[j]
+                S[C[j]] -= 1
+                j = R[j]
+            self.nPrunings += 1
+            i = D[i]
+
+    def uncover(self, col):
+        '''Undo cover(col), in the reverse order'''
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        i = U[col]
+        while i != col:
+            j = L[i]
+            while j != i:
+                S[C[j]] += 1
+                U[D[j]] = j
+                D[U[j]] = j
+                j = L[j]
+            i = U[i]
+        R[L[col]] = col
+        L[R[col]] = col
+
+    def dlx_search(self):
+        '''Search for an exact cover and print the result like bt_search'''
+        self.clear_stats()
+        self.solution = None
+        stime = time.process_time()
+        if self.numtree != 1:
+            print("DLX{} only solves one tree puzzles, numtree = {}".format(
+                self.name, self.numtree))
+            return False
+        status = self.dlx_recurse([])
+        self.runtime = time.process_time() - stime
+        if status:
+            print("DLX {} solved. CPU Time used = {}".format(self.name,
+                                                             self.runtime))
+        else:
+            print("DLX{} unsolved. Has no solutions".format(self.name))
+        print("dlx_search finished")
+        self.print_stats()
+        return status
+
+    def dlx_recurse(self, chosen):
+        '''Algorithm X: cover the primary column with fewest rows, try
+        each of its rows. On success the cover is saved in
+        self.solution; the matrix is always restored before returning'''
+        R, L, D, C, S = self.R, self.L, self.D, self.C, self.S
+        if R[0] == 0:
+            self.solution = [self.cell_of[node] for node in chosen]
+            return True
+        col = R[0]
+        fewest = S[col]
+        j = R[col]
+        while j != 0 and fewest > 1:
+            if S[j] < fewest:
+                col = j
+                fewest = S[j]
+            j = R[j]
+        if fewest == 0:
+            return False
+        status = False
+        self.cover(col)
+        i = D[col]
+        while i != col and not status:
+            self.nDecisions += 1
+            chosen.append(i)
+            j = R[i]
+            while j != i:
+                self.cover(C[j])
+                j = R[j]
+            status = self.dlx_recurse(chosen)
+            j = L[i]
+            while j != i:
+                self.uncover(C[j])
+                j = L[j]
+            chosen.pop()
+            i = D[i]
+        self.uncover(col)
+        return status
+
+    def grid(self):
+        '''the solution as rows of 0/1, like AlberiSolver's varlist values'''
+        n = self.dim
+        rows = [[0] * n for _ in range(n)]
+        for r, c in self.solution or []:
+            rows[r][c] = 1
+        return rows
+
+    def print_solution(self):
+        for row in self.grid():
+            print(row)
@@ -12,22 +12,41 @@ from propagators import *
 
 class AlberiSolver:
 
-    def __init__(self, board, model, propagator, heur, trees, priority):
+    def __init__(self, board, model, propagator, heur, trees, priority,
+                 search="BT", budget=None, value_order="static",
+                 cached=False):
         self.numtree = trees
         self.heuristic = heur
         self.board = board
         self.model = model
-        # Time the model creation
+        # Time the model creation. cached == True reparks the cached
+        # skeleton of the board's size instead (see cached_model), which
+        # the next cached solver of that size takes over: only for a
+        # solver run before another one is created
         model_start_time = time.time()
-        cspmodel = model(board, priority, self.numtree)
+        if cached:
+            cspmodel = cached_model(model, board, priority, self.numtree)
+        else:
+            cspmodel = model(board, priority, self.numtree)
         model_finish_time = time.time()
         self.model_creation_time = model_finish_time - model_start_time
         self.varlist = cspmodel[1]
         self.csp = cspmodel[0]
         self.dim = len(self.varlist)
+        # propagator is a propagator function or its name, e.g. "prop_count"
+        if isinstance(propagator, str):
+            propagator = props_by_name[propagator]
         self.propagator = propagator
         self.heuristic = heur
+        # search is a key of search_modes, e.g. "CBJ" for backjumping
+        self.search = search
+        # value_order is a key of value_orders, e.g. "LCV"
+        self.value_order = value_order
+        # budget is a Budget bounding the search, None for no limits
+        self.budget = budget
         self.runtime = 1000000000
+        # True solved, False no solution, None stopped by the budget
+        self.status = None
 
     def print_solution(self):
         for row in self.varlist:
@@ -37,19 +56,20 @@ class AlberiSolver:
         print("Puzzle: {} by {}, {} trees".format(self.dim, self.dim, self.numtree))
         print("Model creation time: {}".format(self.model_creation_time))
         # create backtracking routine
-        bt = BT(self.csp, self.heuristic)
+        bt = BT(self.csp, self.heuristic, self.value_order)
         #bt.trace_on()
-        starttime = time.time()
-        bt.bt_search(self.propagator)
-        self.runtime = time.time() - starttime
+        self.status = bt.bt_search(self.propagator, budget=self.budget,
+                                   **search_modes[self.search])
+        # search time only, bt_search does not count its own printing
+        self.runtime = bt.runtime
         self.print_solution()
 
 def routinetest(board, numtree):
     models = [alberi_model_1, alberi_model_2]
     ms = ["alberi_model_1", "alberi_model_2"]
     orders = [0,1]
-    props = [prop_BT, prop_FC, prop_GAC, prop_alberi]
-    ps = ["prop_FC", "prop_GAC", "prop_alberi"]
+    props = [prop_BT, prop_FC, prop_GAC, prop_alberi, prop_count]
+    ps = ["prop_BT", "prop_FC", "prop_GAC", "prop_alberi", "prop_count"]
     heuristics = ["MAV", "MRV"]
 
 
@@ -63,7 +83,8 @@ def routinetest(board, numtree):
             for k in range(0,len(props)):
                 for m in range(0,len(heuristics)):
                     print("--model:{}-priority:{}-prop:{}-heur:{}".format(ms[i],str(orders[j]),ps[k],heuristics[m]))
-                    alberi = AlberiSolver(board, models[i], props[k], heuristics[m], numtree, orders[j])
+                    alberi = AlberiSolver(board, models[i], props[k], heuristics[m], numtree, orders[j],
+                                          cached=True)
                     alberi.run()
                     if alberi.runtime < mintime:
                         mintime = alberi.runtime
@@ -77,83 +98,16 @@ def routinetest(board, numtree):
 
 
 def test():
-    dic_1tree = dict()
-    dic_1tree[5] = [solveable_1tree3, solveable_1tree4]
-    dic_1tree[6] = [solveable_1tree1, solveable_1tree2]
-    dic_ltree[7] = [solveable_1tree5]
-    dic_2trees = dict()
-    dic_2trees[9] = [solveable_2tree1, solveable_1tree2]
-    dic_2trees[10] = [solveable_2tree3]
-
-    for b_size in dic_1tree:
-        numtree = 1
-        for board in dic_1tree[b_size]:
-
-            print("board size: " + b_size)
-            print("number of trees: " + numtree)
-
-            models = [alberi_model_1, alberi_model_2]
-            ms = ["alberi_model_1", "alberi_model_2"]
-            orders = [0, 1]
-            props = [prop_BT, prop_FC, prop_GAC, prop_alberi]
-            ps = ["prop_FC", "prop_GAC", "prop_alberi"]
-            heuristics = ["MAV", "MRV"]
-            print("===========Compare routines===========")
-            mintime = 100000000
-            minroutine = [0, 0, 0, 0]
-            maxtime = 0
-            maxroutine = [0, 0, 0, 0]
-            for i in range(0, len(models)):
-                for j in range(0, len(orders)):
-                    for k in range(0, len(props)):
-                        for m in range(0, len(heuristics)):
-                            print("--model:{}-priority:{}-prop:{}-heur:{}".format(ms[i], str(orders[j]), ps[k], heuristics[m]))
-                            alberi = AlberiSolver(board, models[i], props[k], heuristics[m], numtree, orders[j])
-                            alberi.run()
-                            if alberi.runtime < mintime:
-                                mintime = alberi.runtime
-                                minroutine = [i, j, k, m]
-                            if alberi.runtime > maxtime:
-                                maxtime = alberi.runtime
-                                maxroutine = [i, j, k, m]
-            print("Fastest routine: {} average time: {}".format(minroutine, mintime))
-            print("Slowest routine: {} average time: {}".format(maxroutine, maxtime))
-
-
-    for b_size in dic_2trees:
-        numtree = 2
-        for board in dic_2trees[b_size]:
-
-            print("board size: " + b_size)
-            print("number of trees: " + numtree)
-
-            models = [alberi_model_1, alberi_model_2]
-            ms = ["alberi_model_1", "alberi_model_2"]
-            orders = [0, 1]
-            props = [prop_BT, prop_FC, prop_GAC, prop_alberi]
-            ps = ["prop_FC", "prop_GAC", "prop_alberi"]
-            heuristics = ["MAV", "MRV"]
-            print("===========Compare routines===========")
-            mintime = 100000000
-            minroutine = [0, 0, 0, 0]
-            maxtime = 0
-            maxroutine = [0, 0, 0, 0]
-            for i in range(0, len(models)):
-                for j in range(0, len(orders)):
-                    for k in range(0, len(props)):
-                        for m in range(0, len(heuristics)):
-                            print("--model:{}-priority:{}-prop:{}-heur:{}".format(ms[i], str(orders[j]), ps[k],
-                                                                                  heuristics[m]))
-                            alberi = AlberiSolver(board, models[i], props[k], heuristics[m], numtree, orders[j])
-                            alberi.run()
-                            if alberi.runtime < mintime:
-                                mintime = alberi.runtime
-                                minroutine = [i, j, k, m]
-                            if alberi.runtime > maxtime:
-                                maxtime = alberi.runtime
-                                maxroutine = [i, j, k, m]
-            print("Fastest routine: {} average time: {}".format(minroutine, mintime))
-            print("Slowest routine: {} average time: {}".format(maxroutine, maxtime))
+    """routinetest on the solvable boards, by number of trees and board
+    size. For timings to rely on use benchmark.bench_suite"""
+    names = ["solveable_1tree3", "solveable_1tree4", "solveable_1tree1",
+             "solveable_1tree2", "solveable_1tree5", "solveable_2tree1",
+             "solveable_2tree2", "solveable_2tree3"]
+    for name in names:
+        board, numtree = testboards[name]
+        print("board size: {}".format(len(board)))
+        print("number of trees: {}".format(numtree))
+        routinetest(board, numtree)
 
 
 if __name__ == '__main__':
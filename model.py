@@ -7,10 +7,11 @@ The models is specified here. We test two different ways to impose the
 constraints. Model 1 takes adjacency constraints as ternary, a.k.a. in any
 2 by 2 area there is at most 1 tree planted. Model 2 has binary adjacency
 constraints which will benefit forward checking pruning but requires way more
-space and time to initialize.
+space and time to initialize. Model 3 has a single global adjacency
+constraint over the whole grid.
 """
 
-def alberi_model_1(board, priority, numtree):
+def alberi_model_1(board, priority, numtree, var_type=Variable):
     """
     This function takes a 2d array input as the board. This file must have
     n rows, each with n characters, e.g.
@@ -26,7 +27,8 @@ def alberi_model_1(board, priority, numtree):
     takes an integer numtree which represents how many trees are there in
     each row/column/park.
     
-    It builds a CSP model with these parameters.
+    It builds a CSP model with these parameters. var_type is the Variable
+    class used for the cells (e.g. ListVariable for benchmarking).
     """
     # Initialize variable list by reading the list
     cons=[]
@@ -36,9 +38,9 @@ def alberi_model_1(board, priority, numtree):
         v_row = []
         for b in range(len(board)):
             if priority:
-                newvar = Variable("V{}{}".format(a,b),[1,0])
+                newvar = var_type("V{}{}".format(a,b),[1,0])
             else:
-                newvar = Variable("V{}{}".format(a,b),[0,1])
+                newvar = var_type("V{}{}".format(a,b),[0,1])
             v_list.append(newvar)
             v_row.append(newvar)
         v_board.append(v_row)
@@ -101,10 +103,11 @@ def alberi_model_1(board, priority, numtree):
                                           v_board[i+1][j+1]],'a',numtree))
     for c in cons:
         csp.add_constraint(c)
+    csp.set_grid(v_board, cons[:len(parknames)])
     return csp, v_board
 
 
-def alberi_model_2(board, priority, numtree):
+def alberi_model_2(board, priority, numtree, var_type=Variable):
     """
     This function takes a 2d array input as the board. This file must have
     n rows, each with n characters, e.g.
@@ -124,6 +127,7 @@ def alberi_model_2(board, priority, numtree):
     
     * Unlike model 1, this model implements the adjacency constraints as
       binary constraints. It will benefit forward checking but make GAC slower
+    * var_type is the Variable class used for the cells, as in model 1.
     """
     
     # Create CSP object
@@ -135,9 +139,9 @@ def alberi_model_2(board, priority, numtree):
         v_row = []
         for b in range(len(board)):
             if priority:
-                newvar = Variable("V{}{}".format(a,b),[1,0])
+                newvar = var_type("V{}{}".format(a,b),[1,0])
             else:
-                newvar = Variable("V{}{}".format(a,b),[0,1])
+                newvar = var_type("V{}{}".format(a,b),[0,1])
             v_list.append(newvar)
             v_row.append(newvar)
         v_board.append(v_row)
@@ -212,5 +216,139 @@ def alberi_model_2(board, priority, numtree):
                 
     for c in cons:
         csp.add_constraint(c)
+    csp.set_grid(v_board, cons[:len(parknames)])
+    return csp, v_board
+    
+
+def alberi_model_3(board, priority, numtree, var_type=Variable):
+    """
+    Same board, numtree and var_type as model 1 and model 2.
+
+    * The adjacency rule is one global constraint over the whole grid
+      (NoTouchConstraint): it knows the neighbours of every cell, so a
+      tree prunes its 8 neighbours in one step. The model has O(n)
+      constraints (parks, rows, columns and this one) instead of the
+      O(n^2) adjacency constraints of model 1 and model 2.
+    """
+    # Initialize variable list by reading the list
+    cons=[]
+    v_list = []
+    v_board = []
+    for a in range(len(board)):
+        v_row = []
+        for b in range(len(board)):
+            if priority:
+                newvar = var_type("V{}{}".format(a,b),[1,0])
+            else:
+                newvar = var_type("V{}{}".format(a,b),[0,1])
+            v_list.append(newvar)
+            v_row.append(newvar)
+        v_board.append(v_row)
+    # Create CSP object
+    csp = CSP("alberi3",v_list)
+    # Impose park constraints, the cells of each park in board order
+    parks = dict()
+    for row, v_row in zip(board, v_board):
+        for d, var in zip(row, v_row):
+            parks.setdefault(d, []).append(var)
+    for e, parkscope in parks.items():
+        cons.append(Constraint("ParkCon-{}".format(e),parkscope,'o',numtree))
+    # Impose row constraints
+    for row_n, rowscope in enumerate(v_board, 1):
+        cons.append(Constraint("RowCon-{}".format(row_n),rowscope,'o',numtree))
+    # Impose column constraints
+    for col_n in range(len(v_board)):
+        colscope = [v_row[col_n] for v_row in v_board]
+        cons.append(Constraint("ColCon-{}".format(col_n),colscope,'o',numtree))
+    # Impose the adjacency rule on the whole grid at once
+    cons.append(NoTouchConstraint("NoTouch", v_board, numtree))
+    for c in cons:
+        csp.add_constraint(c)
+    csp.set_grid(v_board, cons[:len(parks)])
     return csp, v_board
-    
\ No newline at end of file
+
+
+# the models by name, e.g. for a portfolio configuration
+models_by_name = {
+    "alberi_model_1": alberi_model_1,
+    "alberi_model_2": alberi_model_2,
+    "alberi_model_3": alberi_model_3,
+}
+
+
+class ModelSkeleton:
+    """
+    The model of an n by n board with everything but the parks built
+    once: variables, row, column and adjacency constraints depend only on
+    n, numtree and priority. repark(board) puts the park constraints of
+    a board in, replacing the last board's, and resets the variables, in
+    O(cells). The constraints come in the order the model function adds
+    them (parks first), so a search on a reparked skeleton makes the same
+    decisions as on a freshly built model.
+    """
+
+    def __init__(self, model, n, priority, numtree, var_type=Variable):
+        # one park covering the board: its constraint is the first of
+        # the CSP and of every variable's list, the rest is the skeleton
+        self.csp, self.varlist = model([[0] * n for _ in range(n)],
+                                       priority, numtree, var_type)
+        self.numtree = numtree
+        self.structure = self.csp.cons[1:]
+        self.own = [v.cons[1:] for v in self.csp.vars]
+
+    def repark(self, board):
+        """Make the skeleton the model of board, return (csp, varlist)"""
+        parks = dict()          #park label -> its number
+        scopes = []
+        park_of = []            #park number of each variable
+        for row, v_row in zip(board, self.varlist):
+            for label, var in zip(row, v_row):
+                p = parks.setdefault(label, len(parks))
+                if p == len(scopes):
+                    scopes.append([])
+                scopes[p].append(var)
+                park_of.append(p)
+        parkcons = [Constraint("ParkCon-{}".format(e), scopes[p], 'o',
+                               self.numtree)
+                    for e, p in parks.items()]
+        # an aborted search may have left its trail, revisions and index
+        # hooks behind
+        self.csp.trail = None
+        self.csp.queue.clear()
+        for var, own, p in zip(self.csp.vars, self.own, park_of):
+            var.selector = None
+            var.con_buckets = None
+            if var.is_assigned():
+                var.unassign()
+            var.restore_curdom()
+            var.cons[:] = [parkcons[p]] + own
+        self.csp.cons[:] = parkcons + self.structure
+        for c in self.csp.cons:
+            c.recount()
+        # weights learned on another board mean nothing here
+        self.csp.reset_weights()
+        self.csp.set_grid(self.varlist, parkcons)
+        return self.csp, self.varlist
+
+
+skeletons = dict()      #(model, n, priority, numtree, var_type) -> skeleton
+
+
+def cached_model(model, board, priority, numtree, var_type=Variable):
+    """
+    Same as model(board, priority, numtree, var_type) for the models of
+    models_by_name, but reparks a cached ModelSkeleton of the board's
+    size instead of building the CSP. The CSP returned is therefore
+    reused by the next call with the same size, numtree, model and
+    priority: finish with one board before asking for the next (as
+    benchmark, portfolio workers and AlberiSolver(cached=True) do).
+    Other model functions are just called.
+    """
+    if model not in models_by_name.values():
+        return model(board, priority, numtree, var_type)
+    key = (model, len(board), priority, numtree, var_type)
+    skeleton = skeletons.get(key)
+    if skeleton is None:
+        skeleton = skeletons[key] = ModelSkeleton(model, len(board), priority,
+                                                  numtree, var_type)
+    return skeleton.repark(board)
@@ -0,0 +1,201 @@
+from cspbase import *
+from model import *
+from propagators import *
+from testcase import testboards
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+"""
+Parallel tree search with work stealing. Every worker process builds the
+model once and searches subproblems with bt_search(..., iterative=True).
+A subproblem is a partial assignment, a list of (variable name, value)
+pairs given to bt_search as assumptions; the first one is the empty
+assignment, the whole puzzle.
+
+Subproblems wait on a shared queue. While a worker waits for one it is
+counted as idle, and a busy worker that sees an idle worker and an empty
+queue splits its own search (see BT.give_away): the untried values of
+its shallowest choice point go on the queue, each with the assignments
+above it. The tree is so split at the shallowest decision levels, where
+the subtrees are biggest, and only when somebody needs work.
+
+The first solution found ends the search and the other workers are
+terminated. There is no solution only when every subproblem is closed:
+a shared count of open subproblems goes up before a split puts its
+subproblems on the queue and down when a worker finishes one, and the
+worker that brings it to 0 reports it.
+
+A configuration is (model, priority, propagator, heuristic) as in
+portfolio.py, without the search mode: the search is always bt_iterate.
+
+    python parallel.py solveable_3trees [workers] [timeout]
+"""
+
+default_config = ("alberi_model_1", 0, "prop_count", "MAV-O")
+
+# busy workers look for idle ones every this many decisions
+check_every = 64
+
+
+class Sharer:
+    """
+    BT.sharer of a worker: hungry() tells bt_iterate to give work away
+    when a worker is idle and the queue is empty, give() puts the
+    subproblems on the queue. It also adds the worker's decisions to the
+    shared count as it goes.
+    """
+
+    def __init__(self, bt, tasks, open_count, total, idle, nodes):
+        self.bt = bt
+        self.tasks = tasks
+        self.open_count = open_count
+        self.total = total
+        self.idle = idle
+        self.nodes = nodes
+        self.calls = 0
+        self.counted = 0
+
+    def count_nodes(self):
+        with self.nodes.get_lock():
+            self.nodes.value += self.bt.nDecisions - self.counted
+        self.counted = self.bt.nDecisions
+
+    def hungry(self):
+        self.calls += 1
+        if self.calls % check_every:
+            return False
+        self.count_nodes()
+        return self.idle.value > 0 and self.tasks.empty()
+
+    def give(self, subproblems):
+        with self.open_count.get_lock():
+            self.open_count.value += len(subproblems)
+        with self.total.get_lock():
+            self.total.value += len(subproblems)
+        for sp in subproblems:
+            self.tasks.put([(var.name, val) for var, val in sp])
+
+
+def worker(board, numtree, config, tasks, results, open_count, total, idle,
+           nodes):
+    """
+    Worker process: take subproblems off tasks and search them, printing
+    nothing. Puts ("sat", grid) on results for a solution, ("unsat",)
+    when it closes the last open subproblem and ("error", why) if it
+    fails, so parallel_solve never waits for a subproblem nobody closes.
+    """
+    try:
+        sys.stdout = open(os.devnull, "w")
+        model, priority, prop, heur = config
+        csp, varlist = models_by_name[model](board, priority, numtree)
+        by_name = {var.name: var for var in csp.vars}
+        propagator = props_by_name[prop]
+        bt = BT(csp, heur)
+        bt.sharer = sharer = Sharer(bt, tasks, open_count, total, idle, nodes)
+        while True:
+            with idle.get_lock():
+                idle.value += 1
+            task = tasks.get()
+            with idle.get_lock():
+                idle.value -= 1
+            sharer.counted = 0
+            status = bt.bt_search(propagator, iterative=True,
+                                  assumptions=[(by_name[name], val)
+                                               for name, val in task])
+            sharer.count_nodes()
+            if status is None:
+                raise RuntimeError("search stopped by the {} limit".format(
+                    bt.stopped))
+            if status:
+                results.put(("sat", [[var.get_assigned_value() for var in row]
+                                     for row in varlist]))
+                return
+            with open_count.get_lock():
+                open_count.value -= 1
+                last = open_count.value == 0
+            if last:
+                results.put(("unsat",))
+    except Exception as e:
+        results.put(("error", repr(e)))
+
+
+def parallel_solve(board, numtree, config=default_config, workers=None,
+                   timeout=None):
+    """
+    Search board with workers processes (by default one per CPU). Returns
+    a dict with the status (True solved, False no solution, None if
+    timeout seconds passed first, "error" if a worker failed, with
+    "error" saying why), the solution grid (None without one),
+    nDecisions (of all workers together), subproblems (the whole puzzle
+    plus every one split off) and the wallclock time.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    start = time.perf_counter()
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    open_count = multiprocessing.Value("i", 1)
+    total = multiprocessing.Value("i", 1)
+    idle = multiprocessing.Value("i", 0)
+    nodes = multiprocessing.Value("q", 0)
+    tasks.put([])
+    procs = [multiprocessing.Process(
+                 target=worker,
+                 args=(board, numtree, config, tasks, results, open_count,
+                       total, idle, nodes),
+                 daemon=True)
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    try:
+        message = results.get(timeout=timeout)
+    except queue.Empty:
+        message = (None,)
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.join()
+    wallclock = time.perf_counter() - start
+    status = {"sat": True, "unsat": False, "error": "error",
+              None: None}[message[0]]
+    result = {"status": status,
+              "solution": message[1] if status is True else None,
+              "nDecisions": nodes.value,
+              "subproblems": total.value,
+              "wallclock": wallclock}
+    if status == "error":
+        result["error"] = message[1]
+    return result
+
+
+def run_parallel(board, numtree, config=default_config, workers=None,
+                 timeout=None):
+    """parallel_solve and print the outcome like AlberiSolver.run"""
+    print("Puzzle: {} by {}, {} trees".format(len(board), len(board), numtree))
+    print("Parallel search, model:{} priority:{} prop:{} heur:{}".format(
+        *config))
+    result = parallel_solve(board, numtree, config, workers, timeout)
+    if result["status"] == "error":
+        print("A worker failed: {}".format(result["error"]))
+    elif result["status"]:
+        print("Solved. Time used = {}".format(result["wallclock"]))
+        for row in result["solution"]:
+            print(row)
+    elif result["status"] is None:
+        print("Stopped after {} seconds, unknown".format(result["wallclock"]))
+    else:
+        print("Unsolved. Has no solutions. Time used = {}".format(
+            result["wallclock"]))
+    print("Search made {} variable assignments in {} subproblems".format(
+        result["nDecisions"], result["subproblems"]))
+    return result
+
+
+if __name__ == '__main__':
+    board, numtree = testboards[sys.argv[1]]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    timeout = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    run_parallel(board, numtree, workers=workers, timeout=timeout)
@@ -0,0 +1,132 @@
+from cspbase import *
+from model import *
+from propagators import *
+from testcase import testboards
+import contextlib
+import multiprocessing
+import os
+import sys
+import time
+
+"""
+Portfolio solving: run several solver configurations on the same board
+in a process pool and keep the first answer. A solution and a proof that
+there is none are equally final, so whichever configuration finishes
+first wins and the other workers are terminated.
+
+A configuration is a tuple of names
+    (model, priority, propagator, heuristic, search)
+e.g. ("alberi_model_1", 0, "prop_count", "MAV-O", "BT"), looked up in
+models_by_name, props_by_name and search_modes.
+
+    python portfolio.py solveable_2tree3 [workers]
+"""
+
+# a few configurations that each do well on some of testcase.py's boards
+default_configs = [
+    ("alberi_model_1", 0, "prop_count", "MAV-O", "BT"),
+    ("alberi_model_1", 0, "prop_GAC", "MAV-O", "CBJ+learning"),
+    ("alberi_model_2", 0, "prop_count", "MRV", "learning"),
+    ("alberi_model_1", 1, "prop_alberi", "MAV", "CBJ"),
+    ("alberi_model_2", 0, "prop_GAC", "MAV-O", "BT"),
+    ("alberi_model_1", 0, "prop_count", "MRV+DEG", "BT"),
+    ("alberi_model_1", 0, "prop_count", "dom/wdeg", "CBJ+learning"),
+]
+
+
+def routine_configs():
+    """every combination main.routinetest compares, as configurations"""
+    return [(model, priority, prop, heur, "BT")
+            for model in ["alberi_model_1", "alberi_model_2"]
+            for priority in [0, 1]
+            for prop in ["prop_BT", "prop_FC", "prop_GAC", "prop_alberi",
+                         "prop_count"]
+            for heur in ["MAV", "MRV"]]
+
+
+def solve_config(job):
+    """
+    Worker: solve board with one configuration, printing nothing.
+    job is (board, numtree, config) or (board, numtree, config, limits)
+    with limits a dict of Budget arguments, e.g. {"time": 10}. Returns a
+    dict with the config, the status (True solved, False no solution,
+    None stopped by a limit), the limit that stopped it (None if none
+    did), the solution grid (None without one), nDecisions, nPrunings
+    and the runtime.
+    """
+    board, numtree, config = job[:3]
+    budget = Budget(**job[3]) if len(job) > 3 and job[3] else None
+    model, priority, prop, heur, search = config
+    start = time.perf_counter()
+    csp, varlist = cached_model(models_by_name[model], board, priority,
+                                numtree)
+    bt = BT(csp, heur)
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            status = bt.bt_search(props_by_name[prop], budget=budget,
+                                  **search_modes[search])
+    grid = None
+    if status:
+        grid = [[var.get_assigned_value() for var in row] for row in varlist]
+    return {"config": config, "status": status, "stopped": bt.stopped,
+            "solution": grid,
+            "nDecisions": bt.nDecisions, "nPrunings": bt.nPrunings,
+            "runtime": time.perf_counter() - start}
+
+
+def portfolio_solve(board, numtree, configs=default_configs, workers=None):
+    """
+    Run the configurations on board in a pool of workers (by default one
+    per CPU, never more than there are configurations) and return the
+    result (see solve_config) of the first one to finish, plus a
+    "wallclock" entry for the whole portfolio. The pool is terminated as
+    soon as that result is in. A configuration that raises is skipped;
+    None is returned if all of them do.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(configs)))
+    start = time.perf_counter()
+    jobs = [(board, numtree, config) for config in configs]
+    winner = None
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.imap_unordered(solve_config, jobs)
+        while winner is None:
+            try:
+                winner = next(results)
+            except StopIteration:
+                break
+            except Exception as e:
+                print("Portfolio worker failed: {}".format(e))
+        pool.terminate()
+    if winner is not None:
+        winner["wallclock"] = time.perf_counter() - start
+    return winner
+
+
+def run_portfolio(board, numtree, configs=default_configs, workers=None):
+    """portfolio_solve and print the outcome like AlberiSolver.run"""
+    print("Puzzle: {} by {}, {} trees".format(len(board), len(board), numtree))
+    print("Portfolio of {} configurations".format(len(configs)))
+    result = portfolio_solve(board, numtree, configs, workers)
+    if result is None:
+        print("Portfolio failed, no configuration finished")
+        return None
+    print("Winner: model:{} priority:{} prop:{} heur:{} search:{}".format(
+        *result["config"]))
+    if result["status"]:
+        print("Solved. Time used = {}".format(result["wallclock"]))
+        for row in result["solution"]:
+            print(row)
+    else:
+        print("Unsolved. Has no solutions. Time used = {}".format(
+            result["wallclock"]))
+    print("Search made {} variable assignments and pruned {} variable values".format(
+        result["nDecisions"], result["nPrunings"]))
+    return result
+
+
+if __name__ == '__main__':
+    board, numtree = testboards[sys.argv[1]]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    run_portfolio(board, numtree, workers=workers)
@@ -0,0 +1,337 @@
+from cspbase import *
+from model import *
+from propagators import *
+from testcase import testboards
+from collections import defaultdict
+import contextlib
+import os
+import sys
+import time
+
+"""
+Opt-in profiling of a BT search. Nothing in cspbase or propagators.py
+knows about it: while Profiler.run searches, the methods worth watching
+are wrapped on the objects themselves (instance attributes shadowing
+the class methods) and unwrapped after, so a search that is not
+profiled runs exactly the code it always did.
+
+Counted and timed (perf_counter_ns) are
+    per propagator      calls, revisions, prunings, wipe-outs (calls
+                        that found a deadend), time
+    per constraint      revisions (pops off csp.queue), has_support and
+                        consistent calls, prunings and wipe-outs it was
+                        the reason of, time
+    per type            the same summed by constraint type ('o', 'a',
+                        't', or nogood for learned nogoods)
+    pick_var            calls and time
+A revision lasts from the pop of a constraint off csp.queue to the next
+pop or the end of the propagator call, so propagators that revise inline
+(prop_count) are timed per constraint too. Queue pushes and pops and the
+has_support/consistent calls are timed as frames of their own.
+
+The times are written as a table or as folded stacks, one line per
+frame path with its own (self) time in microseconds, e.g.
+    bt_search;prop_GAC;o;ParkCon-3;has_support 1520
+which flamegraph.pl and speedscope read.
+
+    python profiler.py solveable_2tree2 alberi_model_1 prop_GAC MRV BT [out.folded]
+
+(priority 0; profile() takes a whole portfolio.py configuration).
+"""
+
+# constraint methods timed per constraint
+checks = ("has_support", "consistent")
+
+
+def kind_of(reason):
+    """constraint type of a pruning reason, "nogood" for a nogood"""
+    if isinstance(reason, Constraint):
+        return reason.get_type()
+    return "nogood"
+
+
+def name_of(reason):
+    if isinstance(reason, Constraint):
+        return reason.name
+    return "nogood"
+
+
+class Profiler:
+    """
+    Statistics of the searches run through run() (they add up over
+    several runs). Frame times are nanoseconds keyed by frame paths,
+    tuples like ("prop_GAC", "o", "ParkCon-3", "has_support").
+    """
+
+    def __init__(self):
+        self.props = defaultdict(lambda: defaultdict(int))
+        self.cons = defaultdict(lambda: defaultdict(int))
+        self.kinds = dict()         #constraint name -> type
+        self.frames = defaultdict(int)
+        self.picks = 0
+        self.search_ns = 0
+        self.prop = None            #name of the running propagator
+        self.current = None         #constraint under revision, or None
+        self.since = 0              #when the revision started
+        self.nested = 0             #leaf time inside the revision
+        self.inner = 0              #time of the propagator's inner frames
+        self.patched = []           #(object, attribute) to unwrap
+
+    def patch(self, obj, attr, wrapper):
+        setattr(obj, attr, wrapper)
+        self.patched.append((obj, attr))
+
+    def unpatch(self):
+        for obj, attr in self.patched:
+            delattr(obj, attr)
+        self.patched = []
+
+    def con(self, reason):
+        name = name_of(reason)
+        self.kinds[name] = kind_of(reason)
+        return self.cons[name]
+
+    def leaf(self, frame, dt):
+        """dt nanoseconds spent in frame (a check or a queue operation),
+        under the constraint being revised if any"""
+        if self.current is not None:
+            self.nested += dt
+            self.frames[(self.prop, self.kinds[self.current.name],
+                         self.current.name) + frame] += dt
+        else:
+            self.inner += dt
+            self.frames[(self.prop,) + frame] += dt
+
+    def end_revision(self, now):
+        c = self.current
+        if c is not None:
+            dt = now - self.since
+            self.inner += dt
+            self.frames[(self.prop, self.kinds[c.name], c.name)] += dt - self.nested
+            self.cons[c.name]["time"] += dt
+            self.current = None
+            self.nested = 0
+
+    def watch_constraints(self, csp):
+        for c in csp.cons:
+            self.kinds[c.name] = c.get_type()
+            for attr in checks:
+                self.patch(c, attr, self.timed_check(c, attr,
+                                                     getattr(c, attr)))
+
+    def timed_check(self, c, attr, method):
+        stats = self.cons[c.name]
+        clock = time.perf_counter_ns
+
+        def check(*args):
+            t0 = clock()
+            result = method(*args)
+            dt = clock() - t0
+            stats[attr] += 1
+            if self.current is c:
+                # the revision of c is timed already
+                self.leaf((attr,), dt)
+                return result
+            # prop_BT, prop_FC, or c checked while another is revised
+            stats["time"] += dt
+            if self.current is not None:
+                self.leaf((self.kinds[c.name], c.name, attr), dt)
+            elif self.prop is not None:
+                self.inner += dt
+                self.frames[(self.prop, self.kinds[c.name], c.name,
+                             attr)] += dt
+            return result
+        return check
+
+    def watch_queue(self, queue):
+        clock = time.perf_counter_ns
+        pop, push, extend = queue.pop, queue.push, queue.extend
+
+        def timed_pop():
+            t0 = clock()
+            self.end_revision(t0)
+            c = pop()
+            t1 = clock()
+            self.leaf(("queue",), t1 - t0)
+            if self.prop is not None:
+                self.props[self.prop]["revisions"] += 1
+            self.con(c)["revisions"] += 1
+            self.current = c
+            self.since = t1
+            return c
+
+        def timed_push(c):
+            t0 = clock()
+            push(c)
+            self.leaf(("queue",), clock() - t0)
+
+        def timed_extend(cons):
+            t0 = clock()
+            extend(cons)
+            self.leaf(("queue",), clock() - t0)
+
+        self.patch(queue, "pop", timed_pop)
+        self.patch(queue, "push", timed_push)
+        self.patch(queue, "extend", timed_extend)
+
+    def watch_trail(self, trail):
+        prune, fail, record = trail.prune, trail.fail, trail.record
+
+        def counted_prune(var, val, reason=None):
+            prune(var, val, reason)
+            if self.prop is not None:
+                self.props[self.prop]["prunings"] += 1
+            if reason is not None:
+                self.con(reason)["prunings"] += 1
+
+        def counted_fail(reason, var=None):
+            fail(reason, var)
+            if reason is not None:
+                self.con(reason)["wipeouts"] += 1
+
+        def counted_record(prunings):
+            record(prunings)
+            if self.prop is not None:
+                self.props[self.prop]["prunings"] += len(prunings)
+
+        self.patch(trail, "prune", counted_prune)
+        self.patch(trail, "fail", counted_fail)
+        self.patch(trail, "record", counted_record)
+
+    def watch_bt(self, bt):
+        clock = time.perf_counter_ns
+        pick_var = bt.pick_var
+
+        def timed_pick_var():
+            t0 = clock()
+            var = pick_var()
+            self.frames[("pick_var",)] += clock() - t0
+            self.picks += 1
+            return var
+        self.patch(bt, "pick_var", timed_pick_var)
+
+    def wrap(self, propagator):
+        """propagator counted and timed. bt_search sets up its trail
+        before the first call, which then gets watched too"""
+        name = propagator.__name__
+        clock = time.perf_counter_ns
+        watched = []
+
+        def prop(csp, newVar=None):
+            if csp.trail is not None and csp.trail not in watched:
+                watched.append(csp.trail)
+                self.watch_trail(csp.trail)
+            if csp.queue not in watched:
+                watched.append(csp.queue)
+                self.watch_queue(csp.queue)
+            self.prop = name
+            self.inner = 0
+            stats = self.props[name]
+            stats["calls"] += 1
+            t0 = clock()
+            try:
+                status, prunings = propagator(csp, newVar)
+            finally:
+                t1 = clock()
+                self.end_revision(t1)
+                self.prop = None
+                stats["time"] += t1 - t0
+                self.frames[(name,)] += t1 - t0 - self.inner
+            if not status:
+                stats["wipeouts"] += 1
+            return status, prunings
+        prop.__name__ = name
+        return prop
+
+    def run(self, bt, propagator, **search_args):
+        """bt.bt_search(propagator, **search_args) profiled, return its
+        status"""
+        self.watch_bt(bt)
+        self.watch_constraints(bt.csp)
+        try:
+            status = bt.bt_search(self.wrap(propagator), **search_args)
+        finally:
+            self.unpatch()
+        self.search_ns += bt.search_ns
+        return status
+
+    def folded(self):
+        """the folded stack lines, self times in microseconds"""
+        lines = []
+        below = sum(self.frames.values())
+        frames = dict(self.frames)
+        frames[()] = self.search_ns - below
+        for path, ns in sorted(frames.items()):
+            us = ns // 1000
+            if us > 0:
+                lines.append("{} {}".format(";".join(("bt_search",) + path), us))
+        return lines
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for line in self.folded():
+                f.write(line + "\n")
+
+    def by_kind(self):
+        """constraint statistics summed per constraint type"""
+        kinds = defaultdict(lambda: defaultdict(int))
+        for name, stats in self.cons.items():
+            for key, value in stats.items():
+                kinds[self.kinds[name]][key] += value
+            kinds[self.kinds[name]]["constraints"] += 1
+        return kinds
+
+    def print_table(self, out=sys.stdout, top=15):
+        """the statistics as text tables, the top constraints by time"""
+        ms = lambda ns: "{:.1f}".format(ns / 1e6)
+        out.write("search {} ms, pick_var {} calls {} ms\n".format(
+            ms(self.search_ns), self.picks,
+            ms(self.frames.get(("pick_var",), 0))))
+        row = "{:<20}{:>10}{:>11}{:>10}{:>10}{:>11}\n"
+        out.write(row.format("propagator", "calls", "revisions", "prunings",
+                             "wipeouts", "ms"))
+        for name, s in sorted(self.props.items()):
+            out.write(row.format(name, s["calls"], s["revisions"],
+                                 s["prunings"], s["wipeouts"], ms(s["time"])))
+        row = "{:<20}{:>11}{:>11}{:>12}{:>10}{:>10}{:>11}\n"
+        out.write(row.format("type", "revisions", "checks", "constraints",
+                             "prunings", "wipeouts", "ms"))
+        for kind, s in sorted(self.by_kind().items()):
+            out.write(row.format(kind, s["revisions"],
+                                 s["has_support"] + s["consistent"],
+                                 s["constraints"], s["prunings"],
+                                 s["wipeouts"], ms(s["time"])))
+        out.write(row.format("constraint", "revisions", "checks", "type",
+                             "prunings", "wipeouts", "ms"))
+        ranked = sorted(self.cons.items(), key=lambda item: -item[1]["time"])
+        for name, s in ranked[:top]:
+            out.write(row.format(name, s["revisions"],
+                                 s["has_support"] + s["consistent"],
+                                 self.kinds[name], s["prunings"],
+                                 s["wipeouts"], ms(s["time"])))
+
+
+def profile(board, numtree, config, out=None):
+    """
+    Profile one search of board with config, (model, priority,
+    propagator, heuristic, search) as in portfolio.py. Prints the table
+    and writes the folded stacks to out if given. Returns the Profiler
+    """
+    model, priority, prop, heur, search = config
+    csp, varlist = models_by_name[model](board, priority, numtree)
+    bt = BT(csp, heur)
+    profiler = Profiler()
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            profiler.run(bt, props_by_name[prop], **search_modes[search])
+    profiler.print_table()
+    if out is not None:
+        profiler.write_folded(out)
+    return profiler
+
+
+if __name__ == '__main__':
+    board, numtree = testboards[sys.argv[1]]
+    model, prop, heur, search = sys.argv[2:6]
+    out = sys.argv[6] if len(sys.argv) > 6 else None
+    profile(board, numtree, (model, 0, prop, heur, search), out)
@@ -36,6 +36,16 @@ propagator == a function with the following template
     NOTE propagator SHOULD NOT prune a value that has already been
     pruned! Nor should it prune a value twice
 
+    The propagators below do not build that list themselves. They prune
+    through csp.pruner(), which is the search Trail while bt_search runs
+    (the pruning is recorded on it and the trail is returned in place of
+    the list) and a PruneList, i.e. the list above, otherwise.
+
+    For nogood learning (bt_search(..., learning=True)) they also say
+    why: prune(var, val, c) names the constraint c that ruled the value
+    out, and before returning False they call fail(c) when c itself is
+    violated or fail(c, var) when c emptied the domain of var.
+
     PROPAGATOR called with newly_instantiated_variable = None
         PROCESSING REQUIRED:
             for plain backtracking (where we only check fully instantiated
@@ -59,10 +69,59 @@ propagator == a function with the following template
 
             for gac we initialize the GAC queue with all constraints containing
             V.
+
+    The GAC queue of prop_GAC and prop_alberi is csp.queue, a RevisionQueue
+    that holds each constraint at most once. csp.set_queue_policy chooses
+    whether it is worked LIFO (the default) or FIFO.
+
+    The global no touch constraint of alberi_model_3 (type 't', over the
+    whole grid) is never revised from the queue. Whenever a variable
+    becomes a tree the propagators take 1 out of its neighbours right
+    away (made_tree), prop_FC does the same for the new variable and
+    prop_BT checks the new variable's neighbours.
 '''
 
 from cspbase import *
 
+try:
+    popcount = int.bit_count
+except AttributeError:          #before python 3.10
+    def popcount(x):
+        return bin(x).count("1")
+
+
+def prune_neighbours(c, var, prune_list):
+    '''c is a global no touch constraint (NoTouchConstraint) and var a
+    tree: take 1 out of the domains of var's neighbours in one step.
+    Return the neighbours pruned, None on a deadend'''
+    pruned = []
+    for y in c.neighbours[var]:
+        if y.in_cur_domain(1):
+            if y.is_assigned():
+                c.clash = var
+                prune_list.fail(c)
+                return None
+            prune_list.prune(y, 1, c)
+            if y.cur_domain_size() == 0:
+                prune_list.fail(c, y)
+                return None
+            pruned.append(y)
+    return pruned
+
+def made_tree(var, constraints, prune_list):
+    '''var has become a tree: the global no touch constraints over it
+    prune its neighbours, whose constraints are queued on constraints.
+    Return False on a deadend (constraints is then cleared)'''
+    for c in var.cons:
+        if c.type == 't':
+            pruned = prune_neighbours(c, var, prune_list)
+            if pruned is None:
+                constraints.clear()
+                return False
+            for y in pruned:
+                constraints.extend(y.cons)
+    return True
+
 def prop_BT(csp, newVar=None):
     '''Do plain backtracking propagation. That is, do no
     propagation at all. Just check fully instantiated constraints'''
@@ -70,12 +129,15 @@ def prop_BT(csp, newVar=None):
     if not newVar:
         return True, []
     for c in csp.get_cons_with_var(newVar):
-        if c.get_n_unasgn() == 0:
-            vals = []
-            vars = c.get_scope()
-            for var in vars:
-                vals.append(var.get_assigned_value())
-            if not c.check(vals):
+        if c.get_type() == 't':
+            # only the new variable's neighbours matter
+            if not c.has_support(newVar, newVar.get_assigned_value()):
+                c.clash = newVar
+                csp.pruner().fail(c)
+                return False, []
+        elif c.get_n_unasgn() == 0:
+            if not c.consistent():
+                csp.pruner().fail(c)
                 return False, []
     return True, []
 
@@ -110,7 +172,7 @@ def prop_FC(csp, newVar=None):
     '''
 
 #IMPLEMENT
-    prune_list = []
+    prune_list = csp.pruner()
     constraints = []
 
     if newVar is not None:
@@ -118,28 +180,26 @@ def prop_FC(csp, newVar=None):
     else:
         constraints = csp.get_all_cons()
     for c in constraints:
+        if c.get_type() == 't':
+            # a new tree loses its neighbours (FC on the adjacent pairs)
+            if newVar is not None and not newVar.in_cur_domain(0):
+                if prune_neighbours(c, newVar, prune_list) is None:
+                    return False, prune_list
+            continue
         # Find constraint with only one uninstantiated variable
         if c.get_n_unasgn() == 1:
             # Get the uninstantiated variable
             var = c.get_unasgn_vars()[0]
             # Get its current domain
-            curdom = var.cur_domain()
+            curdom = var.cur_values()
             for d in curdom:
-                # Try to assign value d to variable
-                var.assign(d)
-                # Check if assigning d to var violates c
-                vals = []
-                vars = c.get_scope()
-                for asvar in vars:
-                    vals.append(asvar.get_assigned_value())
-                if not c.check(vals):
-                    if var.in_cur_domain(d):
-                        prune_list.append((var, d))
-                        var.prune_value(d)
-                # Undo assignment
-                var.unassign()
+                # With every other variable assigned, the constraint's
+                # counters tell exactly whether var = d satisfies c
+                if not c.has_support(var, d):
+                    prune_list.prune(var, d, c)
             # If the domain of d is wiped out, a deadend is found
-            if not var.cur_domain():
+            if var.cur_domain_size() == 0:
+                prune_list.fail(c, var)
                 return False, prune_list
     # If checking on all constraints pass, we succeed.
     return True, prune_list
@@ -169,33 +229,42 @@ def prop_GAC(csp, newVar=None):
     '''
 
 #IMPLEMENT
-    constraints = []
-    prune_list = []
+    constraints = csp.queue
+    prune_list = csp.pruner()
 
+    constraints.clear()
     if newVar is not None:
-        constraints = csp.get_cons_with_var(newVar)
+        constraints.extend(newVar.cons)
+        if not newVar.in_cur_domain(0):
+            if not made_tree(newVar, constraints, prune_list):
+                return False, prune_list
     else:
-        constraints = csp.get_all_cons()
+        constraints.extend(csp.cons)
     while constraints:
         c = constraints.pop()
+        if c.get_type() == 't':
+            continue    # made_tree did its work
         # Get list of unasigned variables
         vars = c.get_unasgn_vars()
         # For each unasigned variable check its GAC
         for var in vars:
-            curdom = var.cur_domain()
+            curdom = var.cur_values()
             for d in curdom:
                 # Try assigning d to variable
                 # var.assign(d)
                 # Do GAC check on assignment
                 if not c.has_support(var, d):
                     if var.in_cur_domain(d):
-                        prune_list.append((var, d))
-                        var.prune_value(d)
-                        for newcon in csp.get_cons_with_var(var):
-                            if not newcon in constraints:
-                                constraints.append(newcon)
+                        prune_list.prune(var, d, c)
+                        # the constraints over var are queued once
+                        constraints.extend(var.cons)
+                        if d == 0 and not made_tree(var, constraints,
+                                                    prune_list):
+                            return False, prune_list
             # If variable domain is emptied, a deadend is reached
-            if not var.cur_domain():
+            if var.cur_domain_size() == 0:
+                constraints.clear()
+                prune_list.fail(c, var)
                 return False, prune_list
 
 
@@ -209,21 +278,27 @@ def prop_alberi(csp, newVar=None):
     constraints filled as soon as the total number of trees in a constraint
     reaches the global variable numtree.
     """
-    # prepare a list for constraints and a list for pruned values
-    constraints = []
-    prune_list = []
+    # prepare the revision queue and a list for pruned values
+    constraints = csp.queue
+    prune_list = csp.pruner()
     
     # for each constraint affected by this newVar, put the constraint in
-    # the list. If there is no new variable, put all constraints in the list
+    # the queue. If there is no new variable, put all constraints in it
+    constraints.clear()
     if newVar is not None:
-        constraints = csp.get_cons_with_var(newVar)
+        constraints.extend(newVar.cons)
+        if not newVar.in_cur_domain(0):
+            if not made_tree(newVar, constraints, prune_list):
+                return False, prune_list
     else:
-        constraints = csp.get_all_cons()
+        constraints.extend(csp.cons)
 
 
     # Then all constraints are dealt as follows:
     while constraints:
         c = constraints.pop()
+        if c.get_type() == 't':
+            continue    # made_tree did its work
         # Get list of unasigned variables
         # If the constraint is of type o and new assigned value is 1
         # Add all assigned values up. If it reaches numtree, then prune "1" from
@@ -232,42 +307,292 @@ def prop_alberi(csp, newVar=None):
         # Otherwise, do nothing.
         # Do GAC
         if c.get_type() == 'o' and newVar and newVar.get_assigned_value() == 1:
-            curval = 0
-            for var in c.get_scope():
-                if var.is_assigned():
-                    curval += var.get_assigned_value()
-            if curval == c.numtree:
+            if c.sum_asgn == c.numtree:
                 unasign_vars = c.get_unasgn_vars()
                 for var in unasign_vars:
                     if var.in_cur_domain(1):
-                        prune_list.append((var, 1))
-                        var.prune_value(1)
-                        for newcon in csp.get_cons_with_var(var):
-                            if not newcon in constraints:
-                                constraints.append(newcon)
-                # If variable domain is emptied, a deadend is reached
-                if not var.cur_domain():
-                    return False, prune_list
+                        prune_list.prune(var, 1, c)
+                        constraints.extend(var.cons)
+                        # If variable domain is emptied, a deadend is reached
+                        if var.cur_domain_size() == 0:
+                            constraints.clear()
+                            prune_list.fail(c, var)
+                            return False, prune_list
         else:
             # Otherwise, do GAC
             vars = c.get_unasgn_vars()
             # For each unasigned variable check its GAC
             for var in vars:
-                curdom = var.cur_domain()
+                curdom = var.cur_values()
                 for d in curdom:
                     # Try assigning d to variable
                     # var.assign(d)
                     # Do GAC check on assignment
                     if not c.has_support(var, d):
                         if var.in_cur_domain(d):
-                            prune_list.append((var, d))
-                            var.prune_value(d)
-                            for newcon in csp.get_cons_with_var(var):
-                                if not newcon in constraints:
-                                    constraints.append(newcon)
+                            prune_list.prune(var, d, c)
+                            constraints.extend(var.cons)
+                            if d == 0 and not made_tree(var, constraints,
+                                                        prune_list):
+                                return False, prune_list
                 # If variable domain is emptied, a deadend is reached
-                if not var.cur_domain():
+                if var.cur_domain_size() == 0:
+                    constraints.clear()
+                    prune_list.fail(c, var)
                     return False, prune_list
 
     # If check on all variables in all constraints pass, return True
-    return True, prune_list
\ No newline at end of file
+    return True, prune_list
+
+def prop_count(csp, newVar=None):
+    """
+    Counting propagator for the cardinality constraints. A row, column or
+    park ('o') must hold exactly numtree trees and an adjacency constraint
+    ('a') at most one, so instead of asking has_support for every
+    variable/value pair we count, in one pass over the scope, the trees
+    already there (assigned 1 or only 1 left in the domain) and the
+    candidates (both values still possible). Then
+        - trees > upper bound, or trees + candidates < numtree: deadend
+        - trees == upper bound: no candidate can be a tree, prune 1
+        - trees + candidates == numtree: every candidate is a tree, prune 0
+    Pruned variables queue their constraints like in GAC.
+    """
+    constraints = csp.queue
+    prune_list = csp.pruner()
+
+    constraints.clear()
+    if newVar is not None:
+        constraints.extend(newVar.cons)
+        if not newVar.in_cur_domain(0):
+            if not made_tree(newVar, constraints, prune_list):
+                return False, prune_list
+    else:
+        constraints.extend(csp.cons)
+    while constraints:
+        c = constraints.pop()
+        if c.get_type() == 't':
+            continue    # made_tree did its work
+        if c.n_asgn == len(c.scope):
+            if not c.consistent():
+                constraints.clear()
+                prune_list.fail(c)
+                return False, prune_list
+            continue
+        # count trees and candidates among the unassigned variables
+        trees = c.sum_asgn
+        candidates = 0
+        for var in c.scope:
+            if not var.is_assigned():
+                if var.in_cur_domain(1):
+                    if var.in_cur_domain(0):
+                        candidates += 1
+                    else:
+                        trees += 1
+        if c.get_type() == 'o':
+            most = c.numtree
+            if trees + candidates < most:
+                constraints.clear()
+                prune_list.fail(c)
+                return False, prune_list
+        else:
+            most = 1
+        if trees > most:
+            constraints.clear()
+            prune_list.fail(c)
+            return False, prune_list
+        if candidates == 0:
+            continue
+        if trees == most:
+            prune = 1
+        elif c.get_type() == 'o' and trees + candidates == most:
+            prune = 0
+        else:
+            continue
+        for var in c.scope:
+            if (not var.is_assigned() and var.in_cur_domain(0)
+                    and var.in_cur_domain(1)):
+                prune_list.prune(var, prune, c)
+                constraints.extend(var.cons)
+                if prune == 0 and not made_tree(var, constraints, prune_list):
+                    return False, prune_list
+
+    return True, prune_list
+
+
+def park_groups(masks, n):
+    """
+    Groups of parks whose candidate cells lie in as many lines (rows or
+    columns). masks[p] is the bitset of the lines park p still has
+    candidates in. Tried: the lines of each park, with all the parks
+    inside them, and every interval of lines, with the parks inside it.
+    Returns a set of (parks bitset, lines bitset), None if some lines
+    hold more parks than there are lines (a deadend).
+    """
+    groups = set()
+    for m in masks:
+        inside = 0
+        count = 0
+        for q, mq in enumerate(masks):
+            if mq & ~m == 0:
+                inside |= 1 << q
+                count += 1
+        size = popcount(m)
+        if count > size:
+            return None
+        if count == size and size < n:
+            groups.add((inside, m))
+    # parks by the last line they reach, for the intervals (none has
+    # no candidates left, it would have been a deadend above)
+    by_last = [[] for _ in range(n)]
+    for q, mq in enumerate(masks):
+        by_last[mq.bit_length() - 1].append(q)
+    for a in range(n):
+        inside = 0
+        count = 0
+        for b in range(a, n):
+            for q in by_last[b]:
+                if masks[q] >> a << a == masks[q]:
+                    inside |= 1 << q
+                    count += 1
+            if count > b - a + 1:
+                return None
+            if count == b - a + 1 and b - a + 1 < n:
+                groups.add((inside, ((1 << (b + 1)) - 1) >> a << a))
+    return groups
+
+def line_groups(masks, n):
+    """
+    Intervals of lines whose candidate cells lie in as many parks.
+    masks[l] is the bitset of the parks line l still has candidates in.
+    Returns a list of (lines bitset, parks bitset), None if some lines
+    reach fewer parks than there are lines (a deadend).
+    """
+    groups = []
+    for a in range(n):
+        parks = 0
+        for b in range(a, n):
+            parks |= masks[b]
+            size = popcount(parks)
+            if size < b - a + 1:
+                return None
+            if size == b - a + 1 and b - a + 1 < n:
+                groups.append((((1 << (b + 1)) - 1) >> a << a, parks))
+    return groups
+
+def region_round(csp, prune_list):
+    """
+    One round of pigeonhole reasoning on the board of csp (see
+    CSP.set_grid). Every row, column and park holds numtree trees, so
+    when m parks have all their candidates in m rows those rows have no
+    trees for other parks, and when m rows have all their candidates in
+    m parks those parks have no trees in other rows (columns alike).
+    The candidates of each park and line are kept as bitsets of lines
+    and parks. Return the variables pruned, None on a deadend.
+    """
+    grid = csp.grid
+    n = len(grid)
+    parks = csp.parks
+    park_of = csp.park_of
+    cell_of = csp.cell_of
+    park_lines = ([0] * len(parks), [0] * len(parks))   #rows, columns
+    line_parks = ([0] * n, [0] * n)
+    for r, row in enumerate(grid):
+        for c, var in enumerate(row):
+            if var.in_cur_domain(1):
+                p = park_of[var]
+                park_lines[0][p] |= 1 << r
+                park_lines[1][p] |= 1 << c
+                line_parks[0][r] |= 1 << p
+                line_parks[1][c] |= 1 << p
+    # (cells to look at, bitset the cell's park or line must be in, axis)
+    rules = []
+    for axis in (0, 1):
+        groups = park_groups(park_lines[axis], n)
+        if groups is None:
+            prune_list.fail(None)
+            return None
+        for inside, lines in groups:
+            cells = [grid[l][i] if axis == 0 else grid[i][l]
+                     for l in range(n) if lines >> l & 1 for i in range(n)]
+            rules.append((cells, inside, None))
+        groups = line_groups(line_parks[axis], n)
+        if groups is None:
+            prune_list.fail(None)
+            return None
+        for lines, inside in groups:
+            cells = [var for p in range(len(parks)) if inside >> p & 1
+                     for var in parks[p].scope]
+            rules.append((cells, lines, axis))
+    pruned = []
+    for cells, inside, axis in rules:
+        for var in cells:
+            if axis is None:
+                where = park_of[var]
+            else:
+                where = cell_of[var][axis]
+            if inside >> where & 1 or not var.in_cur_domain(1):
+                continue
+            if var.is_assigned():
+                prune_list.fail(None)
+                return None
+            prune_list.prune(var, 1)
+            if var.cur_domain_size() == 0:
+                prune_list.fail(None, var)
+                return None
+            pruned.append(var)
+    return pruned
+
+def with_regions(propagator):
+    """
+    propagator followed by pigeonhole reasoning (region_round): the two
+    alternate, propagator run on each variable the regions pruned, until
+    neither prunes more. The regions need a board, csp.grid; without one
+    this is just propagator.
+    """
+    def prop(csp, newVar=None):
+        prune_list = csp.pruner()
+
+        def keep(prunings):
+            # outside bt_search each call prunes into a new PruneList
+            if prunings is not prune_list:
+                if isinstance(prune_list, PruneList):
+                    prune_list.extend(prunings)
+                else:
+                    prune_list.record(prunings)
+
+        status, prunings = propagator(csp, newVar)
+        keep(prunings)
+        while status and csp.grid is not None:
+            pruned = region_round(csp, prune_list)
+            if pruned is None:
+                return False, prune_list
+            if not pruned:
+                break
+            for var in pruned:
+                status, prunings = propagator(csp, var)
+                keep(prunings)
+                if not status:
+                    break
+        return status, prune_list
+    prop.__name__ = propagator.__name__ + "_region"
+    return prop
+
+# pigeonhole reasoning on its own, checking constraints like prop_BT
+prop_region = with_regions(prop_BT)
+prop_region.__name__ = "prop_region"
+# and layered over prop_alberi or prop_count
+prop_alberi_region = with_regions(prop_alberi)
+prop_count_region = with_regions(prop_count)
+
+
+# the propagators by name, e.g. for AlberiSolver or a command line
+props_by_name = {
+    "prop_BT": prop_BT,
+    "prop_FC": prop_FC,
+    "prop_GAC": prop_GAC,
+    "prop_alberi": prop_alberi,
+    "prop_count": prop_count,
+    "prop_region": prop_region,
+    "prop_alberi_region": prop_alberi_region,
+    "prop_count_region": prop_count_region,
+}
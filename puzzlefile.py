@@ -0,0 +1,140 @@
+from model import *
+from testcase import testboards
+from array import array
+import mmap
+import struct
+import sys
+
+"""
+Compact binary corpus of alberi puzzles. A file is
+
+    header  "ALBR", puzzle count (u32), offset of the index (u64)
+    records one per puzzle: size (u8), numtree (u8), then size * size
+            park ids (u8), row by row
+    index   offset of each record (u64)
+
+all little endian. Park ids number a board's parks 0, 1, ... in the
+order they first appear, so boards of up to 255 by 255 with up to 256
+parks fit. The file is memory-mapped: puzzle i is found through the
+index entry i and only its own bytes are read, however big the corpus.
+
+Models only compare park labels, so the boards read back (lists of rows
+of park ids) go straight into alberi_model_1 or alberi_model_2:
+
+    with PuzzleFile("boards.alb") as puzzles:
+        csp, varlist = puzzles.model(7, alberi_model_2)
+
+    python puzzlefile.py convert boards.alb    (testcase.py's boards)
+    python puzzlefile.py show boards.alb 7
+"""
+
+MAGIC = b"ALBR"
+HEADER = struct.Struct("<4sIQ")
+OFFSET = struct.Struct("<Q")
+
+
+def encode_board(board, numtree):
+    """The record of one board as bytes"""
+    size = len(board)
+    if size > 255 or numtree > 255:
+        raise ValueError("board too big for the format")
+    ids = dict()
+    cells = bytearray()
+    for row in board:
+        if len(row) != size:
+            raise ValueError("board is not square")
+        for label in row:
+            if label not in ids:
+                if len(ids) == 256:
+                    raise ValueError("more than 256 parks")
+                ids[label] = len(ids)
+            cells.append(ids[label])
+    return bytes([size, numtree]) + bytes(cells)
+
+
+def write_puzzles(path, puzzles):
+    """Write the (board, numtree) pairs of puzzles, any iterable, to path.
+    Only the record offsets are kept in memory. Returns the count"""
+    offsets = array("Q")
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        for board, numtree in puzzles:
+            offsets.append(f.tell())
+            f.write(encode_board(board, numtree))
+        index = f.tell()
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        offsets.tofile(f)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(offsets), index))
+    return len(offsets)
+
+
+def convert_testboards(path, names=None):
+    """Write testcase.py's boards (all of them by default) to path and
+    return their names, in file order"""
+    names = list(testboards) if names is None else names
+    write_puzzles(path, (testboards[name] for name in names))
+    return names
+
+
+class PuzzleFile:
+    """
+    A puzzle file opened read only and memory-mapped. len() is the
+    number of puzzles, puzzles[i] is (board, numtree) with the board as
+    rows of park ids. model(i, ...) builds the CSP of puzzle i.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.index = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("{} is not a puzzle file".format(path))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("puzzle index out of range")
+        (offset,) = OFFSET.unpack_from(self.map, self.index + 8 * i)
+        size, numtree = self.map[offset], self.map[offset + 1]
+        cells = self.map[offset + 2:offset + 2 + size * size]
+        board = [list(cells[r * size:(r + 1) * size]) for r in range(size)]
+        return board, numtree
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def model(self, i, model=alberi_model_1, priority=0):
+        """model (alberi_model_1 or alberi_model_2) of puzzle i, i.e. its
+        (csp, varlist)"""
+        board, numtree = self[i]
+        return model(board, priority, numtree)
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == "convert":
+        for i, name in enumerate(convert_testboards(sys.argv[2])):
+            print(i, name)
+    elif sys.argv[1] == "show":
+        with PuzzleFile(sys.argv[2]) as puzzles:
+            board, numtree = puzzles[int(sys.argv[3])]
+            print("{} by {}, {} trees".format(len(board), len(board), numtree))
+            for row in board:
+                print(row)
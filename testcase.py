@@ -291,4 +291,34 @@ r2 = [a, a, a, b, b, b]
 r3 = [a, a, a, a, c, b]
 r4 = [d, a, a, c, c, c]
 r5 = [d, e, e, e, f, c]
-r6 = [d, d, e, e, f, f]
\ No newline at end of file
+r6 = [d, d, e, e, f, f]
+
+"""
+all named boards above with the number of trees they are meant for,
+name -> (board, numtree)
+
+NOTE the names do not always match the answer: solveable_3trees has no
+solution (parks b, f and m lie in columns 6-7 only, 9 trees for 6 places)
+while unsolveable_1tree2 and unsolveable_3trees have one (the latter
+found by prop_count_region on alberi_model_3 in about 48s).
+"""
+testboards = {
+    "solveable_1tree1": (solveable_1tree1, 1),
+    "solveable_1tree2": (solveable_1tree2, 1),
+    "solveable_1tree3": (solveable_1tree3, 1),
+    "solveable_1tree4": (solveable_1tree4, 1),
+    "solveable_1tree5": (solveable_1tree5, 1),
+    "unsolveable_1tree1": (unsolveable_1tree1, 1),
+    "unsolveable_1tree2": (unsolveable_1tree2, 1),
+    "unsolveable_1tree3": (unsolveable_1tree3, 1),
+    "unsolveable_1tree4": (unsolveable_1tree4, 1),
+    "unsolveable_1tree5": (unsolveable_1tree5, 1),
+    "solveable_2tree1": (solveable_2tree1, 2),
+    "solveable_2tree2": (solveable_2tree2, 2),
+    "solveable_2tree3": (solveable_2tree3, 2),
+    "unsolveable_2tree1": (unsolveable_2tree1, 2),
+    "unsolveable_2tree2": (unsolveable_2tree2, 2),
+    "unsolveable_2tree3": (unsolveable_2tree3, 2),
+    "solveable_3trees": (solveable_3trees, 3),
+    "unsolveable_3trees": (unsolveable_3trees, 3),
+}